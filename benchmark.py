@@ -0,0 +1,454 @@
+# Benchmark harness for the Smart File Manager hot paths.
+#
+#   python benchmark.py --files 20000 --depth 3 --sizes mixed --output bench_results.json
+#   python benchmark.py --compare bench_baseline.json
+#
+# Every run builds fresh synthetic trees from a seed, times each operation and
+# records files/sec, MB/s, I/O syscalls and peak RSS into a JSON results file.
+# Each benchmark runs in its own subprocess so its RSS figures are its own.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import platform
+import tempfile
+import argparse
+import contextlib
+import subprocess
+import threading
+import tracemalloc
+
+import main as sfm
+
+# ------------------ Synthetic Trees ------------------
+
+# File size distributions: (weight, min bytes, max bytes)
+SIZE_PROFILES = {
+    'small': [(1, 0, 16 * 1024)],
+    'mixed': [(80, 0, 16 * 1024), (18, 16 * 1024, 1024 * 1024), (2, 1024 * 1024, 16 * 1024 * 1024)],
+    'large': [(1, 1024 * 1024, 64 * 1024 * 1024)],
+}
+
+# Extension mixes: every known extension, or a media-heavy inbox
+EXTENSION_MIXES = {
+    'all': sorted({ext for exts in sfm.FILE_CATEGORIES.values() for ext in exts}) + ['', '.unknown'],
+    'media': ['.jpg', '.png', '.mp4', '.mov', '.mp3', '.pdf', '.zip'],
+}
+
+# One reusable block of random bytes; files are slices of it so generation stays fast
+_PAYLOAD = random.Random(0).randbytes(1024 * 1024)
+
+def _write_file(path, size):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            chunk = min(remaining, len(_PAYLOAD))
+            f.write(_PAYLOAD[:chunk])
+            remaining -= chunk
+
+def _pick_size(rng, profile):
+    weights = [w for w, _, _ in profile]
+    _, low, high = rng.choices(profile, weights=weights)[0]
+    return rng.randint(low, high)
+
+# Build a reproducible tree; returns (file paths, total bytes)
+def generate_tree(root, files, depth=2, fanout=8, sizes='mixed', extensions='all', seed=1, mtime_spread_days=0):
+    rng = random.Random(seed)
+    profile = SIZE_PROFILES[sizes]
+    mix = EXTENSION_MIXES[extensions]
+    folders, level = [''], ['']
+    for _ in range(depth):
+        level = [os.path.join(parent, f'dir{i}') for parent in level for i in range(fanout)]
+        folders += level
+    now = time.time()
+    paths, total = [], 0
+    for i in range(files):
+        folder = os.path.join(root, rng.choice(folders))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'file{i}{rng.choice(mix)}')
+        size = _pick_size(rng, profile)
+        _write_file(path, size)
+        if mtime_spread_days:
+            stamp = now - rng.uniform(0, mtime_spread_days * 86400)
+            os.utime(path, (stamp, stamp))
+        paths.append(path)
+        total += size
+    return paths, total
+
+# ------------------ Measurement ------------------
+
+# Read and write syscall counters of this process (Linux only); stat calls are counted separately
+def _io_syscalls():
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['syscr']) + int(counters['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+# Forwards to a DirEntry, counting stat() calls that miss its cached result
+class _CountingEntry:
+    def __init__(self, entry, counter):
+        self._entry = entry
+        self._counter = counter
+
+    def stat(self, *args, **kwargs):
+        self._counter.add()
+        return self._entry.stat(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def __fspath__(self):
+        return self._entry.path
+
+# Forwards a scandir iterator, wrapping each entry
+class _CountingScandir:
+    def __init__(self, iterator, counter):
+        self._iterator = iterator
+        self._counter = counter
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _CountingEntry(next(self._iterator), self._counter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._iterator.close()
+
+# Thread-safe count of stat calls (os.stat, os.lstat, DirEntry.stat) while active;
+# covers os.path helpers, os.walk and shutil since they call through the os module
+class _StatCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+
+    def __enter__(self):
+        self._originals = os.stat, os.lstat, os.scandir
+        original_stat, original_lstat, original_scandir = self._originals
+
+        def stat(*args, **kwargs):
+            self.add()
+            return original_stat(*args, **kwargs)
+
+        def lstat(*args, **kwargs):
+            self.add()
+            return original_lstat(*args, **kwargs)
+
+        def scandir(*args, **kwargs):
+            return _CountingScandir(original_scandir(*args, **kwargs), self)
+
+        os.stat, os.lstat, os.scandir = stat, lstat, scandir
+        return self
+
+    def __exit__(self, *exc):
+        os.stat, os.lstat, os.scandir = self._originals
+
+# VmRSS / VmHWM of this process from /proc (Linux only), in KiB
+def _proc_status_kb(field):
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+# Restart peak RSS tracking (Linux: writing 5 to clear_refs resets VmHWM); False if unsupported
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+# Peak resident set size in KiB: since the last reset where supported, otherwise of the
+# (per-benchmark) process so far
+def _peak_rss_kb():
+    peak = _proc_status_kb('VmHWM')
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# Time one operation; with merge=True the dict func returns (e.g. backup counts) is
+# merged into the result, any other return value is discarded
+def measure(name, func, files=0, nbytes=0, merge=False):
+    syscalls_before = _io_syscalls()
+    rss_before = _proc_status_kb('VmRSS')
+    peak_reset = _reset_peak_rss()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), _StatCounter() as stats:
+        started = time.perf_counter()
+        extra = func()
+        seconds = time.perf_counter() - started
+    if not merge or not isinstance(extra, dict):
+        extra = {}
+    syscalls_after = _io_syscalls()
+    peak_rss = _peak_rss_kb()
+    result = {
+        'seconds': round(seconds, 4),
+        'files': files,
+        'bytes': nbytes,
+        'files_per_sec': round(files / seconds, 1) if files and seconds else None,
+        'mb_per_sec': round(nbytes / 1e6 / seconds, 1) if nbytes and seconds else None,
+        'io_syscalls': syscalls_after - syscalls_before if syscalls_before is not None else None,
+        'stat_calls': stats.count,
+        'peak_rss_kb': peak_rss,
+        # Growth over the RSS at the start of this operation; None where the peak cannot be reset
+        'rss_delta_kb': peak_rss - rss_before if peak_reset and peak_rss is not None and rss_before is not None else None,
+    }
+    result.update(extra)
+    print(f"{name:<28} {seconds:>9.3f}s  {result['files_per_sec'] or '-':>12} files/s  "
+          f"{result['mb_per_sec'] or '-':>9} MB/s")
+    return result
+
+# ------------------ Benchmarks ------------------
+
+def bench_backup(workdir, args):
+    root = os.path.join(workdir, 'backup')
+    paths, total = generate_tree(root, args.files, args.depth, sizes=args.sizes, extensions=args.extensions, seed=args.seed)
+    cold = measure('backup_files (cold)', lambda: sfm.backup_files(root), len(paths), total, merge=True)
+    warm = measure('backup_files (warm)', lambda: sfm.backup_files(root), len(paths), total, merge=True)
+    return {'backup_files_cold': cold, 'backup_files_warm': warm}
+
+def bench_sort(workdir, args):
+    root = os.path.join(workdir, 'inbox')
+    paths, total = generate_tree(root, args.files, depth=0, sizes='small', extensions=args.extensions, seed=args.seed)
+    return {'move_file_alternate_destination': measure(
+        'move_file_alternate_destination', lambda: sfm.move_file_alternate_destination(root), len(paths), total)}
+
+def bench_detect(workdir, args):
+    rng = random.Random(args.seed)
+    mix = EXTENSION_MIXES[args.extensions]
+    names = [f'/inbox/file{i}{rng.choice(mix)}' for i in range(args.detect_names)]
+    classifier = sfm.Classifier(sniff=False)
+    return {'detect_files': measure('detect_files', lambda: sfm.detect_files(names, classifier), len(names))}
+
+# Bytes still allocated by what func() returns (peak and retained, via tracemalloc)
+def _retained_bytes(func):
+    tracemalloc.start()
+    try:
+        kept = func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return current, peak
+
+# Memory of the paths-plus-dict-of-lists representation against the columnar FileCatalog
+def bench_catalog(workdir, args):
+    mix = EXTENSION_MIXES[args.extensions]
+    count = args.detect_names
+    classifier = sfm.Classifier(sniff=False)
+
+    # Same (folder, name) stream for both, created inside the traced call as a scan would
+    def names():
+        rng = random.Random(args.seed)
+        for i in range(count):
+            yield os.path.join(workdir, 'inbox', f'dir{rng.randrange(1000)}'), f'file{i}{rng.choice(mix)}'
+
+    def as_lists():
+        paths = [os.path.join(folder, name) for folder, name in names()]
+        categorized = {category: [] for category in classifier.categories}
+        for path in paths:
+            category = classifier.classify(path)
+            if category is not None:
+                categorized[category].append(path)
+        return paths, categorized
+
+    def as_catalog():
+        catalog = sfm.FileCatalog()
+        for folder, name in names():
+            catalog.add(catalog.dir_id(folder), name)
+        return catalog, catalog.by_category(classifier)
+
+    results = {}
+    for label, func in (('lists', as_lists), ('catalog', as_catalog)):
+        retained, peak = _retained_bytes(func)
+        result = measure(f'file set as {label}', func, count)
+        result.update(retained_bytes=retained, peak_bytes=peak, bytes_per_file=round(retained / count, 1))
+        results[f'file_set_{label}'] = result
+    lists, catalog = results['file_set_lists'], results['file_set_catalog']
+    catalog['memory_reduction'] = round(1 - catalog['retained_bytes'] / lists['retained_bytes'], 3)
+    print(f"{'':<28} {lists['bytes_per_file']} -> {catalog['bytes_per_file']} bytes/file "
+          f"({catalog['memory_reduction']:.0%} less)")
+    return results
+
+def bench_hash(workdir, args):
+    root = os.path.join(workdir, 'hash')
+    small, small_total = generate_tree(root, args.files, depth=1, sizes='small', seed=args.seed)
+    large = os.path.join(root, 'large.bin')
+    _write_file(large, args.large_mb * 1024 * 1024)
+    return {
+        'hash_file_small': measure('hash_files (small, parallel)', lambda: sfm.hash_files(small), len(small), small_total),
+        'hash_file_large': measure('hash_file (large)', lambda: sfm.hash_file(large), 1, args.large_mb * 1024 * 1024),
+    }
+
+def bench_clean(workdir, args):
+    root = os.path.join(workdir, 'clean')
+    paths, total = generate_tree(root, args.files, depth=0, sizes='small', seed=args.seed, mtime_spread_days=365)
+    start = time.strftime('%Y-%m-%d', time.localtime(time.time() - 365 * 86400))
+    end = time.strftime('%Y-%m-%d', time.localtime(time.time() - 180 * 86400))
+    folder = os.path.basename(root)
+    return {'old_file_clean': measure('old_file_clean', lambda: sfm.old_file_clean(workdir, start, end, folder),
+                                      len(paths), total)}
+
+# Time from file creation to its backup under a burst of events
+def bench_watcher(workdir, args):
+    root = os.path.join(workdir, 'watch')
+    os.makedirs(root)
+    created, finished = {}, {}
+    done = threading.Event()
+
+    class TimedHandler(sfm.RealTimeBackupHandler):
+        def _safely(self, func, *call_args):
+            super()._safely(func, *call_args)
+            if func is sfm.backup_paths:
+                now = time.perf_counter()
+                for path in call_args[1]:
+                    finished.setdefault(path, now)
+                if len(finished) >= args.burst:
+                    done.set()
+
+    from watchdog.observers import Observer
+
+    handler = TimedHandler(root, debounce=args.debounce)
+    handler.start()
+    observer = Observer()
+    observer.schedule(handler, path=root, recursive=True)
+    observer.start()
+
+    def burst():
+        for i in range(args.burst):
+            path = os.path.join(root, f'event{i}.txt')
+            created[path] = time.perf_counter()
+            _write_file(path, 512)
+        done.wait(timeout=60)
+
+    try:
+        result = measure('watcher burst', burst, args.burst, args.burst * 512)
+    finally:
+        observer.stop()
+        observer.join()
+        handler.stop()
+    latencies = sorted(finished[p] - created[p] for p in created if p in finished)
+    if latencies:
+        result['latency_p50'] = round(latencies[len(latencies) // 2], 4)
+        result['latency_p95'] = round(latencies[int(len(latencies) * 0.95) - 1], 4)
+        result['latency_max'] = round(latencies[-1], 4)
+    result['events_backed_up'] = len(latencies)
+    return {'watcher_event_to_backup': result}
+
+BENCHMARKS = {
+    'backup': bench_backup,
+    'sort': bench_sort,
+    'detect': bench_detect,
+    'catalog': bench_catalog,
+    'hash': bench_hash,
+    'clean': bench_clean,
+    'watcher': bench_watcher,
+}
+
+# ------------------ Baseline Comparison ------------------
+
+# Print per-operation time ratios against a baseline; returns the regressions beyond the limit
+def compare(results, baseline_path, max_regression):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print(f"\n{'operation':<34} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before or not before.get('seconds'):
+            continue
+        change = current['seconds'] / before['seconds'] - 1
+        print(f"{name:<34} {before['seconds']:>9.3f}s {current['seconds']:>9.3f}s {change:>+7.1%}")
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+# Run one benchmark in a fresh interpreter, so memory held by earlier ones (and the
+# process-lifetime ru_maxrss) does not leak into its figures; returns its results
+def run_isolated(name, workdir, args):
+    output = os.path.join(workdir, f'{name}.json')
+    command = [sys.executable, os.path.abspath(__file__), '--only', name, '--output', output, '--workdir', workdir]
+    for option in ('files', 'depth', 'sizes', 'extensions', 'seed', 'large_mb', 'detect_names', 'burst', 'debounce'):
+        command += ['--' + option.replace('_', '-'), str(getattr(args, option))]
+    subprocess.run(command, check=True)
+    with open(output, 'r', encoding='utf-8') as f:
+        return json.load(f)['results']
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Smart File Manager hot paths')
+    parser.add_argument('--files', type=int, default=5000, help='files per generated tree')
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--sizes', choices=sorted(SIZE_PROFILES), default='mixed')
+    parser.add_argument('--extensions', choices=sorted(EXTENSION_MIXES), default='all')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--large-mb', type=int, default=256, help='size of the large file hashed')
+    parser.add_argument('--detect-names', type=int, default=1_000_000, help='paths classified by detect_files')
+    parser.add_argument('--burst', type=int, default=2000, help='files created during the watcher burst')
+    parser.add_argument('--debounce', type=float, default=0.2)
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='run a subset')
+    parser.add_argument('--workdir', help='where trees are generated (default: a temp folder)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='allowed slowdown before failing')
+    args = parser.parse_args()
+
+    sfm.logger.setLevel(logging.WARNING)
+    names = args.only or list(BENCHMARKS)
+    workdir = tempfile.mkdtemp(prefix='smartfm-bench-', dir=args.workdir)
+    results = {}
+    try:
+        if len(names) == 1:
+            results.update(BENCHMARKS[names[0]](workdir, args))
+        else:
+            for name in names:
+                results.update(run_isolated(name, workdir, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'workdir')},
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.max_regression)
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,41 @@
 # Import required modules
+import time
+_import_started = time.perf_counter()
 import os
 import sys
 import shutil
 import json
+import re
+import fnmatch
+import shlex
+import errno
+import queue
+import stat
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import bisect
+import itertools
+import functools
 import hashlib
+import mmap
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from datetime import datetime
-from colorama import Fore, init
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from array import array
 import threading
-import time
-from dotenv import load_dotenv
-load_dotenv()
-init(autoreset=True)
+
+# watchdog, colorama, dotenv and sqlite3 are imported where they are first needed,
+# so the menu (and scripts importing this module) start without paying for them
+
+# colorama's Fore, resolved on first attribute access
+class _LazyFore:
+    def __getattr__(self, name):
+        from colorama import Fore as fore
+        value = getattr(fore, name)
+        setattr(self, name, value)
+        return value
+
+Fore = _LazyFore()
 # ---------
 # Logging
 
@@ -23,25 +45,177 @@ logger.setLevel(logging.INFO)
 console = logging.StreamHandler()
 console.setLevel(logging.INFO)
 
-fileHandler = logging.FileHandler('smart_file_manager.log')
+fileHandler = logging.FileHandler('smart_file_manager.log', delay=True)   # Opened on first record
 fileHandler.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console.setFormatter(formatter)
 fileHandler.setFormatter(formatter)
-logger.addHandler(console)
-logger.addHandler(fileHandler)
+
+# Callers only enqueue records; console and file writes happen on the listener thread.
+# Per-file messages are logged at DEBUG, so large runs stay cheap at the default level.
+_log_queue = queue.SimpleQueue()
+log_listener = QueueListener(_log_queue, console, fileHandler, respect_handler_level=True)
+logger.addHandler(QueueHandler(_log_queue))
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# ------------------ Metrics ------------------
+
+# Latency histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Operations run under cProfile, e.g. SMARTFM_PROFILE=backup_files,hash_file
+PROFILE_OPERATIONS = set()
+PROFILE_DIR = 'profiles'
+_profiling = threading.local()
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# Process-wide counters, gauges and histograms, exportable as Prometheus text or JSON
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}                  # (name, labels) -> value
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        def flat(key):
+            name, labels = key
+            return {'name': name, 'labels': dict(labels)}
+
+        with self.lock:
+            return {
+                'counters': [dict(flat(k), value=v) for k, v in self.counters.items()],
+                'gauges': [dict(flat(k), value=v) for k, v in self.gauges.items()],
+                'histograms': [dict(flat(k), buckets=dict(zip([str(b) for b in h.buckets] + ['+Inf'], h.counts)),
+                                    sum=h.sum, count=h.count) for k, h in self.histograms.items()],
+            }
+
+    def to_prometheus(self):
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+
+        lines = []
+        with self.lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f'# TYPE {name} {kind}')
+                    for (series_name, labels), value in series.items():
+                        if series_name == name:
+                            lines.append(f'{name}{labels_text(labels)} {value}')
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (series_name, labels), h in self.histograms.items():
+                    if series_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(h.buckets) + ['+Inf'], h.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{labels_text(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_sum{labels_text(labels)} {h.sum}')
+                    lines.append(f'{name}_count{labels_text(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    # Write Prometheus text (.prom/.txt) or a JSON snapshot (anything else)
+    def export(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+metrics = MetricsRegistry()
+
+# Where metrics are exported on exit (SMARTFM_METRICS_FILE); None disables the export
+METRICS_FILE = None
+
+# Run func under cProfile and dump the stats next to other profiles
+def _profile_call(name, func, args, kwargs):
+    import cProfile
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler = cProfile.Profile()
+    _profiling.active = True
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        _profiling.active = False
+        path = os.path.join(PROFILE_DIR, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{threading.get_ident()}.prof')
+        profiler.dump_stats(path)
+        logger.info(f'Profile of {name} written to {path}')
+
+# Count calls and errors and record latency for an operation; profile it when requested
+def instrumented(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                if name in PROFILE_OPERATIONS and not getattr(_profiling, 'active', False):
+                    return _profile_call(name, func, args, kwargs)
+                return func(*args, **kwargs)
+            except BaseException:
+                metrics.inc('smartfm_operation_errors_total', op=name)
+                raise
+            finally:
+                metrics.inc('smartfm_operations_total', op=name)
+                metrics.observe('smartfm_operation_seconds', time.perf_counter() - started, op=name)
+        return wrapper
+    return decorate
 
 # ------------------ File Object Structure ------------------
 
 # Define a class to hold file information
 class Files:
+    __slots__ = ('name', 'path', 'extension', 'date')
+
     def __init__(self, name, path, extension, date):
         self.name = name                    # File name without extension
         self.path = path                    # Path to the directory
         self.extension = extension          # File extension (e.g., .txt)
-        self.fullname = name + extension    # Full file name with extension
         self.date = date                    # Optional date (not actively used)
 
+    # Full file name with extension
+    @property
+    def fullname(self):
+        return self.name + self.extension
+
 # ------------------ File Type Categories ------------------
 
 # Define known file categories and their extensions
@@ -70,7 +244,7 @@ FILE_CATEGORIES = {
 def folder_check(path):
     if not os.path.exists(path):
         os.makedirs(path)
-        logger.info(Fore.GREEN + f'Folder {path} created')
+        logger.debug(Fore.GREEN + f'Folder {path} created')
 
 
 # Check if the path exists
@@ -83,23 +257,596 @@ def ensure_exists(path):
 
 # Get only subfolders from a path
 def list_dirs(path):
-    return [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
+    return [entry.name for entry, _ in scan_tree(path, max_depth=0, exclude=None, files=False, dirs=True)]
+
+# ------------------ Directory Walker ------------------
+
+# The tool's own output folder, directly under a managed base path
+BACKUP_DIR = 'Backup'
+
+# Default exclude of scan_tree: the Backup folder directly under the walked path.
+# Only an exact name at the top counts; a sorted "Backups" category or a nested
+# folder that happens to be called Backup are ordinary user folders.
+def skip_backup(entry):
+    return entry.name == BACKUP_DIR and entry.is_dir(follow_symlinks=False)
+
+# The exclude for a walk of start inside base_path: skip_backup only when start is the
+# base path itself, since a Backup folder further down is user data
+def backup_exclude(base_path, start):
+    return skip_backup if os.path.normpath(start) == os.path.normpath(base_path) else None
+
+# Lazily walk a tree with os.scandir, reusing each DirEntry's cached type and stat.
+# Yields (entry, depth) in pre-order; depth 0 is the direct children of path and
+# max_depth=0 lists a single folder. Unreadable subfolders are logged and skipped,
+# while an unreadable top folder raises OSError like os.listdir would.
+def scan_tree(path, max_depth=None, exclude=skip_backup, files=True, dirs=False, follow_symlinks=False):
+    stack = [(os.scandir(path), 0)]
+    try:
+        while stack:
+            iterator, depth = stack[-1]
+            try:
+                entry = next(iterator, None)
+            except OSError as e:
+                logger.warning(Fore.YELLOW + f'Stopped reading a folder under {path}: {e}')
+                entry = None
+            if entry is None:
+                iterator.close()
+                stack.pop()
+                continue
+            if exclude is not None and (depth == 0 or exclude is not skip_backup) and exclude(entry):
+                continue
+
+            try:
+                is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                if not is_dir:
+                    if files and entry.is_file():
+                        yield entry, depth
+                    continue
+            except OSError:
+                continue
+
+            if dirs:
+                yield entry, depth
+            if max_depth is None or depth < max_depth:
+                try:
+                    stack.append((os.scandir(entry.path), depth + 1))
+                except OSError as e:
+                    logger.warning(Fore.YELLOW + f'Cannot read folder {entry.path}: {e}')
+    finally:
+        for iterator, _ in stack:
+            iterator.close()
+
+# True when a folder has no entries, without listing all of them
+def is_empty_dir(path):
+    with os.scandir(path) as iterator:
+        return next(iterator, None) is None
+
+# ------------------ File Catalog ------------------
+
+# Category id of files no category matched
+NO_CATEGORY = 0xFFFF
+
+# Basenames are stored as bytes the way os.fsencode() would encode them
+FS_ENCODING = sys.getfilesystemencoding()
+FS_ERRORS = sys.getfilesystemencodeerrors()
+
+# Columnar catalog of many files. Folders, extensions and categories are stored once and
+# referenced by id; basenames are packed into one bytearray and sizes and mtimes live in
+# typed arrays. Per file this costs the basename bytes plus ~34 bytes, instead of a full
+# path string (and list slots) or a Files object.
+class FileCatalog:
+    def __init__(self):
+        self.dirs = []                      # Folder id -> folder path
+        self.extensions = []                # Extension id -> lowercased extension ('' for none)
+        self.categories = []                # Category id -> category name
+        self._ids = ({}, {}, {})            # Reverse lookups for the three tables above
+        self.name_data = bytearray()        # Basenames, encoded with FS_ENCODING, back to back
+        self.name_ends = array('Q')         # End offset of each basename in name_data
+        self.dir_ids = array('I')
+        self.ext_ids = array('I')
+        self.category_ids = array('H')
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.has_stat = True                # False when built from bare paths (sizes and mtimes are 0)
+
+    @staticmethod
+    def _intern(table, ids, value):
+        i = ids.get(value)
+        if i is None:
+            i = ids[value] = len(table)
+            table.append(value)
+        return i
+
+    def dir_id(self, folder):
+        return self._intern(self.dirs, self._ids[0], folder)
+
+    def add(self, dir_id, name, size=0, mtime=0.0):
+        self.name_data += name.encode(FS_ENCODING, FS_ERRORS)
+        self.name_ends.append(len(self.name_data))
+        self.dir_ids.append(dir_id)
+        self.ext_ids.append(self._intern(self.extensions, self._ids[1], os.path.splitext(name)[1].lower()))
+        self.category_ids.append(NO_CATEGORY)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+
+    # Files under path (one level unless max_depth says otherwise), stat'ed once while scanning
+    @classmethod
+    def scan(cls, path, max_depth=0, exclude=None):
+        catalog = cls()
+        folder, dir_id = None, None
+        for entry, _ in scan_tree(path, max_depth=max_depth, exclude=exclude):
+            try:
+                st = entry.stat()
+            except OSError as e:
+                logger.warning(Fore.YELLOW + f'Cannot stat {entry.path}: {e}')
+                continue
+            parent = entry.path[:-len(entry.name) - 1]
+            if parent != folder:
+                folder, dir_id = parent, catalog.dir_id(parent)
+            catalog.add(dir_id, entry.name, st.st_size, st.st_mtime)
+        return catalog
+
+    @classmethod
+    def from_paths(cls, paths):
+        catalog = cls()
+        catalog.has_stat = False
+        for path in paths:
+            folder, name = os.path.split(path)
+            catalog.add(catalog.dir_id(folder), name)
+        return catalog
+
+    def __len__(self):
+        return len(self.name_ends)
+
+    def name(self, i):
+        return str(self.name_data[self.name_ends[i - 1] if i else 0:self.name_ends[i]], FS_ENCODING, FS_ERRORS)
+
+    def path(self, i):
+        return os.path.join(self.dirs[self.dir_ids[i]], self.name(i))
+
+    # Iterates and indexes full paths, so a catalog can stand in for a list of paths;
+    # a slice is a CatalogView. record(i) gives the other columns of a row.
+    def __iter__(self):
+        dirs, dir_ids, data = self.dirs, self.dir_ids, self.name_data
+        start = 0
+        for i, end in enumerate(self.name_ends):
+            yield os.path.join(dirs[dir_ids[i]], str(data[start:end], FS_ENCODING, FS_ERRORS))
+            start = end
+
+    def __getitem__(self, i):
+        rows = range(len(self))[i]
+        if isinstance(i, slice):
+            return CatalogView(self, array('I', rows))
+        return self.path(rows)
+
+    def record(self, i):
+        return FileRecord(self, range(len(self))[i])
+
+    def category(self, i):
+        category_id = self.category_ids[i]
+        return None if category_id == NO_CATEGORY else self.categories[category_id]
+
+    # Fill the category column. Without user rules the category only depends on the
+    # extension, so each distinct extension is classified once; extension-less files
+    # are still sniffed one by one.
+    def classify(self, classifier=None):
+        classifier = classifier or get_classifier()
+        category_ids = self._ids[2]
+        for category in classifier.categories:
+            self._intern(self.categories, category_ids, category)
+
+        def category_id(category):
+            return NO_CATEGORY if category is None else self._intern(self.categories, category_ids, category)
+
+        if classifier.rules:
+            for i in range(len(self)):
+                st = os.stat_result((0, 0, 0, 0, 0, 0, self.sizes[i], 0, int(self.mtimes[i]), 0)) if self.has_stat else None
+                self.category_ids[i] = category_id(classifier.classify(self.path(i), st))
+            return self
+
+        by_extension = [category_id(classifier.index.get(ext)) for ext in self.extensions]
+        no_extension = self._ids[1].get('')
+        for i, ext_id in enumerate(self.ext_ids):
+            if ext_id == no_extension and classifier.sniff:
+                self.category_ids[i] = category_id(classifier.sniff_category(self.path(i)))
+            else:
+                self.category_ids[i] = by_extension[ext_id]
+        return self
+
+    # {category: CatalogView} for every category of the classifier, like detect_files()
+    def by_category(self, classifier=None):
+        classifier = classifier or get_classifier()
+        self.classify(classifier)
+        groups = {category: array('I') for category in classifier.categories}
+        by_id = [groups.get(category) for category in self.categories]
+        for i, category_id in enumerate(self.category_ids):
+            if category_id != NO_CATEGORY and by_id[category_id] is not None:
+                by_id[category_id].append(i)
+        return {category: CatalogView(self, indices) for category, indices in groups.items()}
+
+# A subset of a catalog (array of row numbers); iterates and indexes full paths like a
+# list would, slices to a smaller view
+class CatalogView:
+    __slots__ = ('catalog', 'indices')
+
+    def __init__(self, catalog, indices):
+        self.catalog = catalog
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        for i in self.indices:
+            yield self.catalog.path(i)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return CatalogView(self.catalog, self.indices[n])
+        return self.catalog.path(self.indices[n])
+
+    def record(self, n):
+        return FileRecord(self.catalog, self.indices[n])
+
+    def records(self):
+        for i in self.indices:
+            yield FileRecord(self.catalog, i)
+
+    def __repr__(self):
+        return repr(list(self))
+
+# One catalog row, built on demand for the rare per-file access
+class FileRecord:
+    __slots__ = ('catalog', 'i')
+
+    def __init__(self, catalog, i):
+        self.catalog = catalog
+        self.i = i
+
+    @property
+    def name(self):
+        return self.catalog.name(self.i)
+
+    @property
+    def folder(self):
+        return self.catalog.dirs[self.catalog.dir_ids[self.i]]
+
+    @property
+    def path(self):
+        return self.catalog.path(self.i)
+
+    @property
+    def extension(self):
+        return self.catalog.extensions[self.catalog.ext_ids[self.i]]
+
+    @property
+    def size(self):
+        return self.catalog.sizes[self.i]
+
+    @property
+    def mtime(self):
+        return self.catalog.mtimes[self.i]
+
+    @property
+    def category(self):
+        return self.catalog.category(self.i)
+
+    def __repr__(self):
+        return f'FileRecord({self.path!r}, size={self.size}, category={self.category!r})'
+
+# ------------------ Transfer Engine ------------------
+
+# Copy tuning, overridable from the environment (.env)
+TRANSFER_WORKERS = 8
+SMALL_FILE_SIZE = 256 * 1024            # Files below this are copied in batches per task
+SMALL_FILE_BATCH = 64
+COPY_CHUNK_SIZE = 64 * 1024 * 1024      # Max bytes per copy_file_range/sendfile call
+FICLONE = 0x40049409                    # Linux ioctl that makes a copy-on-write reflink
+
+# Kernel copy paths that turned out to be unsupported on this system
+_disabled_copy_methods = set()
+
+# Clone the whole file (btrfs, XFS, APFS-style filesystems); False if unsupported
+def _reflink(in_fd, out_fd):
+    if 'reflink' in _disabled_copy_methods:
+        return False
+    try:
+        import fcntl
+        fcntl.ioctl(out_fd, FICLONE, in_fd)
+        return True
+    except (ImportError, OSError) as e:
+        if isinstance(e, ImportError) or e.errno in (errno.ENOTTY, errno.ENOSYS):
+            _disabled_copy_methods.add('reflink')
+        return False
+
+# Copy size bytes in the kernel with copy_file_range or sendfile; False if neither works
+def _kernel_copy(in_fd, out_fd, size):
+    for method in ('copy_file_range', 'sendfile'):
+        if method in _disabled_copy_methods or not hasattr(os, method):
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if method == 'copy_file_range':
+                    sent = os.copy_file_range(in_fd, out_fd, min(COPY_CHUNK_SIZE, size - offset))
+                else:
+                    sent = os.sendfile(out_fd, in_fd, offset, min(COPY_CHUNK_SIZE, size - offset))
+                if sent == 0:
+                    break
+                offset += sent
+            return True
+        except OSError as e:
+            if e.errno in (errno.ENOSYS, errno.EOPNOTSUPP):
+                _disabled_copy_methods.add(method)
+            if offset:
+                raise
+            # Nothing written yet (EXDEV, EINVAL...): try the next method
+            os.lseek(in_fd, 0, os.SEEK_SET)
+    return False
+
+# Copy data and metadata (like shutil.copy2) using the fastest path available
+def fast_copy(source_path, target_path):
+    with open(source_path, 'rb') as fsrc, open(target_path, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        if not _reflink(in_fd, out_fd) and not _kernel_copy(in_fd, out_fd, size):
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    shutil.copystat(source_path, target_path)
+    return size
+
+# Runs copies and moves on a worker pool, remembers created folders and tracks throughput
+class TransferEngine:
+    def __init__(self, workers=None):
+        self.workers = workers or TRANSFER_WORKERS
+        self.created = set()                # Folders known to exist
+        self.lock = threading.Lock()
+        self.bytes = 0                      # Bytes physically copied
+        self.files = 0                      # Files copied or moved
+        self.failed = 0
+        self.started = None
+
+    def ensure_dir(self, path):
+        if path in self.created:
+            return
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            self.created.add(path)
+
+    # Start the throughput clock before the first transfer, so its time is counted
+    def _begin(self):
+        if self.started is None:
+            with self.lock:
+                if self.started is None:
+                    self.started = time.perf_counter()
+
+    def _account(self, nbytes):
+        with self.lock:
+            self.bytes += nbytes
+            self.files += 1
+        metrics.inc('smartfm_files_transferred_total')
+        metrics.inc('smartfm_bytes_transferred_total', nbytes)
+
+    def copy(self, source_path, target_path):
+        self._begin()
+        self.ensure_dir(os.path.dirname(target_path))
+        size = fast_copy(source_path, target_path)
+        self._account(size)
+        return size
+
+    # Same-device moves are a single rename; across devices copy then unlink
+    def move(self, source_path, target_path):
+        if os.path.exists(target_path):
+            raise FileExistsError(f"Destination path '{target_path}' already exists")
+        self._begin()
+        self.ensure_dir(os.path.dirname(target_path))
+        try:
+            os.rename(source_path, target_path)
+            self._account(0)
+            return 0
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        size = fast_copy(source_path, target_path)
+        os.remove(source_path)
+        self._account(size)
+        return size
+
+    # Run fn(item) for every item on the pool; small items are grouped so per-task
+    # overhead does not dominate. Yields (item, result, error) as batches finish.
+    def map(self, fn, items, size=None):
+        self._begin()
+
+        def run_batch(batch):
+            results = []
+            for item in batch:
+                try:
+                    results.append((item, fn(item), None))
+                except Exception as e:
+                    with self.lock:
+                        self.failed += 1
+                    results.append((item, None, e))
+            return results
+
+        def batches():
+            small = []
+            for item in items:
+                if size is not None and size(item) >= SMALL_FILE_SIZE:
+                    yield [item]
+                    continue
+                small.append(item)
+                if len(small) >= SMALL_FILE_BATCH:
+                    yield small
+                    small = []
+            if small:
+                yield small
+
+        for results in bounded_map(run_batch, batches(), self.workers, 'smartfm-copy'):
+            yield from results
+
+    def throughput(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        rate = self.bytes / elapsed if elapsed > 0 else 0.0
+        return {'files': self.files, 'bytes': self.bytes, 'failed': self.failed,
+                'seconds': round(elapsed, 3), 'bytes_per_second': round(rate)}
+
+    def report(self, label):
+        stats = self.throughput()
+        if stats['files']:
+            print(f"{label}: {stats['files']} files, {stats['bytes'] / 1e6:.1f} MB "
+                  f"in {stats['seconds']:.2f}s ({stats['bytes_per_second'] / 1e6:.1f} MB/s)")
+        logger.info(Fore.BLUE + f'{label} throughput: {stats}')
+        return stats
 
 # ------------------ Back Up System ------------------
-# Backup all files before moving them
-class RealTimeBackupHandler(FileSystemEventHandler):
-    def __init__(self, base_path):
-        super().__init__()
+
+# The manifest lives next to the dated snapshots and is keyed by relative path. Watcher
+# backups append their changes to manifest.log; full backups fold it back into manifest.json.
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_LOG_NAME = 'manifest.log'
+MANIFEST_LOG_MIN = 10000                    # Records the log may always grow to before it is folded in
+MANIFEST_VERSION = 2
+
+# Unique file contents are stored once under Backup/objects, addressed by hash_file();
+# Backup/trees/<date>.json records which blob every path pointed to on that day
+OBJECTS_DIR = 'objects'
+TREES_DIR = 'trees'
+
+# Large, slowly-changing files are stored as fixed-size chunks in the object store plus a
+# recipe (Backup/recipes/ab/cdef....json) listing them, so a day's backup only writes the
+# chunks that changed. Applies to files in DELTA_CATEGORIES from DELTA_MIN_SIZE up, and to
+# any file from DELTA_ANY_SIZE up (VM images, dumps).
+RECIPES_DIR = 'recipes'
+DELTA_CHUNK_SIZE = 4 * 1024 * 1024
+DELTA_MIN_SIZE = 64 * 1024 * 1024
+DELTA_ANY_SIZE = 1024 * 1024 * 1024
+DELTA_CATEGORIES = ('Logs', 'Databases')
+
+# Watcher tuning, overridable from the environment (.env)
+BACKUP_DEBOUNCE_SECONDS = 1.0
+BACKUP_QUEUE_SIZE = 10000
+BACKUP_BATCH_SIZE = 500
+HASH_CACHE_SAVE_SECONDS = 60.0              # The watcher rewrites the hash cache at most this often
+
+# Backups of the same tree must not interleave manifest updates
+_backup_lock = threading.Lock()
+
+# Backup all files before moving them. Implements the watchdog handler protocol
+# (dispatch) directly so watchdog is only imported when the observer starts.
+class RealTimeBackupHandler:
+    def __init__(self, base_path, debounce=None, max_pending=None, batch_size=None, index=None):
         self.base_path = base_path
+        self.index = index                                # Optional FileIndex kept in sync
+        self.debounce = debounce or BACKUP_DEBOUNCE_SECONDS
+        self.batch_size = batch_size or BACKUP_BATCH_SIZE
+        self.events = queue.Queue(maxsize=max_pending or BACKUP_QUEUE_SIZE)  # Raw event paths from the watchdog thread
+        self.overflowed = threading.Event()               # Set when events were dropped
+        self.stopped = threading.Event()
+        self.cache_saved = time.monotonic()
+        self.worker = threading.Thread(target=self._run, name='smartfm-backup', daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.worker.join()
+        self._safely(checkpoint_backup, self.base_path)
+
+    # Same routing as watchdog's FileSystemEventHandler.dispatch; other event types are ignored
+    def dispatch(self, event):
+        handler = getattr(self, 'on_' + event.event_type, None)
+        if handler is not None:
+            handler(event)
+
+    # Called on the watchdog thread: never do I/O here, only queue the path
+    def _enqueue(self, path):
+        if is_backup_path(self.base_path, path):
+            return
+        try:
+            self.events.put_nowait(path)
+            metrics.inc('smartfm_watcher_events_total')
+        except queue.Full:
+            self.overflowed.set()
+            metrics.inc('smartfm_watcher_events_dropped_total')
 
+    # Folders are queued too, so the index learns about empty ones
     def on_created(self, event):
-        if event.is_directory or 'Backup' in event.src_path:
-            return
+        self._enqueue(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._enqueue(event.src_path)
+
+    def on_deleted(self, event):
+        self._enqueue(event.src_path)
+
+    def on_moved(self, event):
+        self._enqueue(event.src_path)
+        self._enqueue(event.dest_path)
+
+    # Collect paths until the tree has been quiet for one debounce window
+    def _collect(self, first):
+        pending = {first}
+        hard_deadline = time.monotonic() + self.debounce * 10
+        while len(pending) < self.batch_size and not self.stopped.is_set():
+            timeout = min(self.debounce, hard_deadline - time.monotonic())
+            if timeout <= 0:
+                break
+            try:
+                pending.add(self.events.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return pending
 
-        backup_files(self.base_path)
+    def _drain(self):
+        while True:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run(self):
+        while not self.stopped.is_set():
+            if self.overflowed.is_set():
+                # Too many events to track individually: reconcile the whole tree once
+                self.overflowed.clear()
+                self._drain()
+                logger.warning(Fore.YELLOW + 'Backup event queue overflowed, running a full reconcile scan.')
+                self._safely(backup_files, self.base_path)
+                if self.index is not None:
+                    self._safely(self.index.rebuild)
+                continue
+            try:
+                first = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            paths = self._collect(first)
+            metrics.set_gauge('smartfm_watcher_queue_depth', self.events.qsize())
+            metrics.observe('smartfm_watcher_batch_size', len(paths))
+            self._safely(backup_paths, self.base_path, paths)
+            if self.index is not None:
+                self._safely(self.index.apply_paths, paths)
+            if time.monotonic() - self.cache_saved >= HASH_CACHE_SAVE_SECONDS:
+                self._safely(get_hash_cache(self.base_path).save)
+                self.cache_saved = time.monotonic()
+
+    def _safely(self, func, *args):
+        try:
+            func(*args)
+        except Exception:
+            logger.exception(Fore.RED + 'Real time backup failed')
+
+# With a shared, already running observer (daemon mode) the path is only scheduled on it
+def start_realtime_backup(path, index=None, observer=None):
+    event_handler = RealTimeBackupHandler(path, index=index)
+    event_handler.start()
+    if observer is not None:
+        observer.schedule(event_handler, path=path, recursive=True)
+        logger.info(Fore.BLUE + f'Watching {path}')
+        return observer, event_handler
+
+    from watchdog.observers import Observer
 
-def start_realtime_backup(path):
-    event_handler = RealTimeBackupHandler(path)
     observer = Observer()
     observer.schedule(event_handler, path=path, recursive=True)
     observer.start()
@@ -112,45 +859,1015 @@ def start_realtime_backup(path):
                 time.sleep(1)
         except KeyboardInterrupt:
             observer.stop()
+            event_handler.stop()
             logger.critical(Fore.RED + 'Real time backup stopped.')
         observer.join()
 
     threading.Thread(target=keep_running, daemon=True).start()
+    return observer, event_handler
+
+# Location of the manifest that records what has already been backed up
+def manifest_path(base_path):
+    return os.path.join(base_path, 'Backup', MANIFEST_NAME)
+
+def manifest_log_path(base_path):
+    return os.path.join(base_path, 'Backup', MANIFEST_LOG_NAME)
+
+# Backup manifest (relative path -> size, mtime_ns, inode, hash). Assignments and deletes
+# are remembered in `changes`, so a backup only has to append what it changed.
+class Manifest(dict):
+    def __init__(self, entries=()):
+        super().__init__(entries)
+        self.changes = {}                   # Relative path -> new entry, or None once deleted
+        self.day = None                     # Day of the last change written to manifest.log
+        self.logged = 0                     # Records in manifest.log since the last full save
+        self.disk_state = None              # manifest_disk_state() when last read or written
+        self.sorted_keys = None             # For delete_subtree(); built on first use, then kept in step
+
+    def __setitem__(self, key, value):
+        if self.sorted_keys is not None and key not in self:
+            bisect.insort(self.sorted_keys, key)
+        super().__setitem__(key, value)
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if self.sorted_keys is not None:
+            del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+        self.changes[key] = None
+
+    # Delete relative_path and everything below it, found by bisecting the sorted keys
+    # instead of testing every key; returns how many entries went
+    def delete_subtree(self, relative_path):
+        if self.sorted_keys is None:
+            self.sorted_keys = sorted(self)
+        start = bisect.bisect_left(self.sorted_keys, relative_path + os.sep)
+        end = bisect.bisect_left(self.sorted_keys, relative_path + chr(ord(os.sep) + 1), start)
+        keys = self.sorted_keys[start:end]
+        del self.sorted_keys[start:end]
+        if relative_path in self:
+            keys.append(relative_path)
+            del self.sorted_keys[bisect.bisect_left(self.sorted_keys, relative_path)]
+        for key in keys:
+            dict.__delitem__(self, key)
+            self.changes[key] = None
+        return len(keys)
+
+# (mtime_ns, size) of manifest.json and manifest.log, to notice another process writing them
+def manifest_disk_state(base_path):
+    state = []
+    for path in (manifest_path(base_path), manifest_log_path(base_path)):
+        try:
+            st = os.stat(path)
+            state.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            state.append(None)
+    return tuple(state)
+
+def manifest_header():
+    return json.dumps({'version': MANIFEST_VERSION, 'algorithm': HASH_ALGORITHM})
+
+# Load the backup manifest: manifest.json, then the changes appended to manifest.log.
+# day_done(day, manifest) is called whenever the log moves on to a later day, with the
+# manifest as it was at the end of that day.
+def load_manifest(base_path, day_done=None):
+    disk_state = manifest_disk_state(base_path)
+    manifest = Manifest()
+    manifest.disk_state = disk_state
+    try:
+        with open(manifest_path(base_path), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != MANIFEST_VERSION or data.get('algorithm') != HASH_ALGORITHM:
+            logger.info(Fore.BLUE + 'Backup manifest is from an older version or hash, rebuilding it.')
+            return manifest
+        dict.update(manifest, data.get('files', {}))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(Fore.YELLOW + f'Backup manifest unreadable, rebuilding it: {e}')
+        return manifest
+    replay_manifest_log(base_path, manifest, day_done)
+    return manifest
+
+# Apply manifest.log: a header line, then one [day, relative path, entry or null] per change.
+# Lines torn by a crash are skipped.
+def replay_manifest_log(base_path, manifest, day_done=None):
+    try:
+        f = open(manifest_log_path(base_path), 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with f:
+        if f.readline().strip() != manifest_header():
+            logger.warning(Fore.YELLOW + 'Backup manifest log is from another version or hash, ignoring it.')
+            return
+        for line in f:
+            try:
+                day, relative_path, entry = json.loads(line)
+            except ValueError:
+                continue
+            if day_done is not None and manifest.day not in (None, day):
+                day_done(manifest.day, manifest)
+            manifest.day = day
+            if entry is None:
+                dict.pop(manifest, relative_path, None)
+            else:
+                dict.__setitem__(manifest, relative_path, entry)
+            manifest.logged += 1
 
-def backup_files(base_path):
+# Append the manifest's pending changes to manifest.log
+def append_manifest_log(base_path, manifest):
+    if not manifest.changes:
+        return
+    day = backup_day()
+    path = manifest_log_path(base_path)
+    folder_check(os.path.dirname(path))
+    lines = [json.dumps([day, relative_path, entry], separators=(',', ':'))
+             for relative_path, entry in manifest.changes.items()]
+    with open(path, 'a+b') as f:
+        if f.tell() == 0:
+            f.write(manifest_header().encode() + b'\n')
+        else:
+            # Never continue a line torn by a crash
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        f.write(('\n'.join(lines) + '\n').encode())
+    manifest.changes.clear()
+    manifest.day = day
+    manifest.logged += len(lines)
+    manifest.disk_state = manifest_disk_state(base_path)
+
+# Write the manifest atomically so a crash never leaves it half written; the log it
+# replaces is removed afterwards
+def save_manifest(base_path, entries):
+    path = manifest_path(base_path)
+    folder_check(os.path.dirname(path))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'algorithm': HASH_ALGORITHM, 'files': entries},
+                  f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    try:
+        os.remove(manifest_log_path(base_path))
+    except FileNotFoundError:
+        pass
+    if isinstance(entries, Manifest):
+        entries.changes.clear()
+        entries.logged = 0
+        entries.disk_state = manifest_disk_state(base_path)
+
+_manifests = {}
+
+# The manifest of a base path kept in memory between backups (callers hold _backup_lock),
+# read again only when another process changed it on disk. Trees of earlier days that
+# only the log still describes are written first, so the manifest is ready for today.
+def current_manifest(base_path):
+    key = os.path.abspath(base_path)
+
+    def day_done(day, entries):
+        write_snapshot_tree(base_path, entries, day)
+
+    manifest = _manifests.get(key)
+    if manifest is None or manifest.disk_state != manifest_disk_state(key):
+        manifest = _manifests[key] = load_manifest(key, day_done)
+    today = backup_day()
+    if manifest.day not in (None, today):
+        day_done(manifest.day, manifest)
+    manifest.day = today
+    return manifest
+
+# Build a manifest entry from a stat result and the content hash
+def file_signature(st, digest):
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino, 'hash': digest}
+
+# A file needs a new backup when its size, mtime or inode differ from the manifest
+def signature_changed(entry, st):
+    return (
+        entry is None
+        or entry.get('size') != st.st_size
+        or entry.get('mtime_ns') != st.st_mtime_ns
+        or entry.get('inode') != st.st_ino
+    )
+
+# Anything under <base>/Backup is tool output, never a backup source
+def is_backup_path(base_path, path):
+    return os.path.relpath(path, base_path).split(os.sep, 1)[0] == BACKUP_DIR
+
+# Walk the base path and yield (relative path, absolute path, stat) for every file.
+# With a folders list, the relative paths of the folders passed are appended to it.
+def iter_backup_sources(base_path, start=None, folders=None):
+    start = start or base_path
+    if is_backup_path(base_path, start):
+        return
+    prefix = os.path.join(base_path, '')
+    # Entries share the base path prefix, so slicing replaces a relpath call per file
+    fast = start == base_path or start.startswith(prefix)
+    try:
+        for entry, _ in scan_tree(start, exclude=backup_exclude(base_path, start), dirs=folders is not None):
+            if folders is not None and entry.is_dir(follow_symlinks=False):
+                folders.append(entry.path[len(prefix):] if fast else os.path.relpath(entry.path, base_path))
+                continue
+            try:
+                st = entry.stat()
+            except OSError as e:
+                logger.warning(Fore.YELLOW + f'Cannot stat {entry.path}: {e}')
+                continue
+            relative_path = entry.path[len(prefix):] if fast else os.path.relpath(entry.path, base_path)
+            yield relative_path, entry.path, st
+    except OSError as e:
+        logger.warning(Fore.YELLOW + f'Cannot read folder {start}: {e}')
+
+# Name of today's snapshot (YYYY-MM-DD)
+def backup_day():
     from datetime import date
 
-    today = date.today().strftime('%Y-%m-%d')
-    backup_root = os.path.join(base_path, 'Backup', today)
-    folder_check(backup_root)
+    return date.today().strftime('%Y-%m-%d')
 
-    files_backed_up = 0
-    for foldername, _, filenames in os.walk(base_path):
-        # Skip backup folders
-        if 'Backup' in foldername:
-            continue
+# Snapshot folder for today's backups
+def today_backup_root(base_path):
+    return os.path.join(base_path, 'Backup', backup_day())
 
-        for filename in filenames:
-            source_path = os.path.join(foldername, filename)
+# Content-addressed blob location: Backup/objects/ab/cdef...
+def object_path(base_path, digest):
+    return os.path.join(base_path, 'Backup', OBJECTS_DIR, digest[:2], digest[2:])
 
-            # Preserve relative structure
-            relative_folder = os.path.relpath(foldername, base_path)
-            target_folder = os.path.join(backup_root, relative_folder)
-            target_path = os.path.join(target_folder, filename)
+# Copy a file into the object store unless that content is already there.
+# Returns False when the source changed while it was being copied.
+def store_object(base_path, engine, source_path, digest, st):
+    target = object_path(base_path, digest)
+    if os.path.exists(target):
+        return True
 
-            if not os.path.exists(target_path):
-                folder_check(target_folder)
-                try:
-                    shutil.copy2(source_path, target_path)
-                    files_backed_up += 1
-                    logger.info('Backup file {} copied to {}'.format(source_path, target_path))
-                except Exception as e:
-                    logger.exception('Failed to backup file {} as {}'.format(source_path,e))
-                    print(f"Failed to backup {source_path}: {e}")
+    tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        engine.copy(source_path, tmp_path)
+        after = os.stat(source_path)
+        if after.st_size != st.st_size or after.st_mtime_ns != st.st_mtime_ns:
+            os.remove(tmp_path)
+            return False
+        make_read_only(tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+# Recipe of a chunked file: {"size": ..., "chunk_size": ..., "chunks": [digest, ...]}
+def recipe_path(base_path, digest):
+    return os.path.join(base_path, 'Backup', RECIPES_DIR, digest[:2], digest[2:] + '.json')
+
+def load_recipe(base_path, digest):
+    try:
+        with open(recipe_path(base_path, digest), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Whether a file is backed up as chunks instead of a whole blob
+def is_delta_candidate(relative_path, st):
+    if st.st_size >= DELTA_ANY_SIZE:
+        return True
+    return st.st_size >= DELTA_MIN_SIZE and relative_path.split(os.sep, 1)[0] in DELTA_CATEGORIES
+
+# Blobs are shared by every snapshot link to them, so nothing may edit them in place
+def make_read_only(path):
+    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+# Write bytes as a blob unless that content is already stored; returns bytes written
+def store_chunk(base_path, digest, data):
+    target = object_path(base_path, digest)
+    if os.path.exists(target):
+        return 0
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        make_read_only(tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(data)
+
+# Split a file into chunks in one read pass, storing the chunks not already in the object
+# store and then its recipe. Returns (whole-file digest, bytes written), or (None, 0) when
+# the source changed while it was read; chunks written by such a pass are left to the GC.
+def store_chunked(base_path, engine, source_path, st):
+    engine._begin()
+    hasher = hashlib.new(HASH_ALGORITHM)
+    chunks, written = [], 0
+    buf = _hash_buffer(DELTA_CHUNK_SIZE)
+    with open(source_path, 'rb', buffering=0) as f, memoryview(buf) as view:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            data = view[:n]
+            hasher.update(data)
+            digest = hashlib.new(HASH_ALGORITHM, data).hexdigest()
+            written += store_chunk(base_path, digest, data)
+            chunks.append(digest)
+
+    after = os.stat(source_path)
+    if after.st_size != st.st_size or after.st_mtime_ns != st.st_mtime_ns:
+        return None, 0
+
+    file_digest = hasher.hexdigest()
+    path = recipe_path(base_path, file_digest)
+    if not os.path.exists(path):
+        engine.ensure_dir(os.path.dirname(path))
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'size': st.st_size, 'chunk_size': DELTA_CHUNK_SIZE, 'chunks': chunks}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    engine._account(written)
+    metrics.inc('smartfm_delta_bytes_read_total', st.st_size)
+    metrics.inc('smartfm_delta_bytes_written_total', written)
+    return file_digest, written
+
+# Reassemble a chunked file from its recipe
+def restore_chunked(base_path, recipe, target_path):
+    tmp_path = target_path + '.tmp'
+    with open(tmp_path, 'wb') as fdst:
+        for digest in recipe['chunks']:
+            with open(object_path(base_path, digest), 'rb') as fsrc:
+                size = os.fstat(fsrc.fileno()).st_size
+                if not _kernel_copy(fsrc.fileno(), fdst.fileno(), size):
+                    shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+        if fdst.tell() != recipe['size']:
+            raise OSError(f'Rebuilt size {fdst.tell()} does not match recipe size {recipe["size"]}')
+    os.replace(tmp_path, target_path)
+    return recipe['size']
+
+# Expose a blob inside the dated snapshot folder as a hardlink (copy if links are unsupported)
+def link_snapshot_file(blob_path, target_path):
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(blob_path, target_path)
+    except OSError:
+        fast_copy(blob_path, target_path)
+
+# Fill a new day's snapshot folder with a link to every manifest entry's blob, so each day
+# can be browsed whole; later backups of the day only link what they store and unlink what
+# went away. The folder starts empty, so nothing is stat'ed first. Chunked files have no
+# single blob to link.
+def link_snapshot_tree(base_path, manifest, backup_root, engine):
+    linked = 0
+    for relative_path, entry in manifest.items():
+        blob_path = object_path(base_path, entry['hash'])
+        target_path = os.path.join(backup_root, relative_path)
+        try:
+            engine.ensure_dir(os.path.dirname(target_path))
+            try:
+                os.link(blob_path, target_path)
+            except FileNotFoundError:
+                continue
+            except FileExistsError:
+                link_snapshot_file(blob_path, target_path)
+            except OSError:
+                fast_copy(blob_path, target_path)
+            linked += 1
+        except OSError as e:
+            logger.warning(Fore.YELLOW + f'Failed to link {relative_path} into {backup_root}: {e}')
+    return linked
+
+# Drop a file or folder from a dated snapshot folder
+def unlink_snapshot_path(backup_root, relative_path):
+    target_path = os.path.join(backup_root, relative_path)
+    try:
+        if os.path.isdir(target_path) and not os.path.islink(target_path):
+            shutil.rmtree(target_path)
+        else:
+            os.remove(target_path)
+    except FileNotFoundError:
+        pass
+
+# Store one changed file whose hash is already known; returns 'copied' or 'failed'.
+# Runs on the transfer pool, so it never touches the manifest itself.
+def backup_entry(base_path, engine, relative_path, source_path, st, digest, backup_root):
+    try:
+        if not store_object(base_path, engine, source_path, digest, st):
+            logger.warning(Fore.YELLOW + f'{source_path} changed during backup, it will be retried.')
+            return 'failed'
+
+        target_path = os.path.join(backup_root, relative_path)
+        engine.ensure_dir(os.path.dirname(target_path))
+        link_snapshot_file(object_path(base_path, digest), target_path)
+        logger.debug('Backup file {} stored as {}'.format(source_path, digest))
+        return 'copied'
+    except Exception as e:
+        logger.exception('Failed to backup file {} as {}'.format(source_path,e))
+        print(f"Failed to backup {source_path}: {e}")
+        return 'failed'
+
+# Store one changed large file as chunks; returns ('copied' or 'skipped', digest) or ('failed', None).
+# The dated snapshot folder gets no browse copy for these, restore_snapshot rebuilds them.
+def backup_chunked_entry(base_path, engine, relative_path, source_path, st, previous, backup_root):
+    try:
+        digest, written = store_chunked(base_path, engine, source_path, st)
+        if digest is None:
+            logger.warning(Fore.YELLOW + f'{source_path} changed during backup, it will be retried.')
+            return 'failed', None
+        # Drop a stale browse copy left from when the file was stored whole
+        target_path = os.path.join(backup_root, relative_path)
+        if os.path.lexists(target_path):
+            os.remove(target_path)
+        logger.debug(f'Backup file {source_path} stored as chunks of {digest}: {written} new bytes')
+        return ('skipped' if digest == previous else 'copied'), digest
+    except Exception as e:
+        logger.exception('Failed to backup file {} as {}'.format(source_path,e))
+        print(f"Failed to backup {source_path}: {e}")
+        return 'failed', None
+
+# Diff sources against the manifest and back up the changed ones: hashes are computed
+# in parallel batches, then new contents are copied on the transfer pool
+def backup_sources(base_path, manifest, sources, backup_root, counts, engine):
+    cache = get_hash_cache(base_path)
+    batch = []
+
+    def store(job):
+        relative_path, source_path, st, digest = job
+        return backup_entry(base_path, engine, relative_path, source_path, st, digest, backup_root)
+
+    # Chunked files are hashed while they are split, so they skip the hashing pass
+    def store_delta(job):
+        relative_path, source_path, st = job
+        previous = (manifest.get(relative_path) or {}).get('hash')
+        return backup_chunked_entry(base_path, engine, relative_path, source_path, st, previous, backup_root)
+
+    def flush():
+        delta = [job for job in batch if is_delta_candidate(job[0], job[2])]
+        if delta:
+            for (relative_path, _, st), outcome, _ in engine.map(store_delta, delta, size=lambda job: job[2].st_size):
+                result, digest = outcome or ('failed', None)
+                if digest is not None:
+                    manifest[relative_path] = file_signature(st, digest)
+                counts[result or 'failed'] += 1
+            batch[:] = [job for job in batch if not is_delta_candidate(job[0], job[2])]
+
+        digests = hash_files([source_path for _, source_path, _ in batch], cache=cache)
+        jobs = []
+        for relative_path, source_path, st in batch:
+            digest = digests.get(source_path)
+            if digest is None:
+                counts['failed'] += 1
+                continue
+            # Metadata changed but the content did not (touch, copy-over)
+            entry = manifest.get(relative_path)
+            if entry is not None and entry.get('hash') == digest:
+                manifest[relative_path] = file_signature(st, digest)
+                counts['skipped'] += 1
+                continue
+            jobs.append((relative_path, source_path, st, digest))
+
+        for (relative_path, _, st, digest), result, _ in engine.map(store, jobs, size=lambda job: job[2].st_size):
+            if result == 'copied':
+                manifest[relative_path] = file_signature(st, digest)
+            counts[result or 'failed'] += 1
+        batch.clear()
+
+    for relative_path, source_path, st in sources:
+        if not signature_changed(manifest.get(relative_path), st):
+            counts['skipped'] += 1
+            continue
+        batch.append((relative_path, source_path, st))
+        if len(batch) >= BACKUP_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+# Record the full tree (relative path -> blob hash) as of a day's snapshot (default today)
+def write_snapshot_tree(base_path, manifest, day=None):
+    trees_folder = os.path.join(base_path, 'Backup', TREES_DIR)
+    folder_check(trees_folder)
+    path = os.path.join(trees_folder, (day or backup_day()) + '.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({rel: entry['hash'] for rel, entry in manifest.items()}, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+# Days that have a recorded snapshot tree, oldest first
+def list_snapshots(base_path):
+    trees_folder = os.path.join(base_path, 'Backup', TREES_DIR)
+    if not os.path.isdir(trees_folder):
+        return []
+    return sorted(f[:-5] for f in os.listdir(trees_folder) if f.endswith('.json'))
+
+# Every hash still referenced by the manifest or by any snapshot tree,
+# including the chunks listed in the recipes of chunked files
+def referenced_objects(base_path):
+    referenced = {entry['hash'] for entry in load_manifest(base_path).values()}
+    trees_folder = os.path.join(base_path, 'Backup', TREES_DIR)
+    for day in list_snapshots(base_path):
+        with open(os.path.join(trees_folder, day + '.json'), 'r', encoding='utf-8') as f:
+            referenced.update(json.load(f).values())
+    for digest in list(referenced):
+        recipe = load_recipe(base_path, digest)
+        if recipe is not None:
+            referenced.update(recipe['chunks'])
+    return referenced
+
+# Delete blobs and recipes no snapshot points to any more; returns (objects removed, bytes freed)
+def collect_garbage(base_path, dry_run=False):
+    objects_folder = os.path.join(base_path, 'Backup', OBJECTS_DIR)
+    recipes_folder = os.path.join(base_path, 'Backup', RECIPES_DIR)
+    if not os.path.isdir(objects_folder):
+        return 0, 0
+    referenced = referenced_objects(base_path)
+    removed = freed = 0
+    entries = scan_tree(objects_folder, exclude=None)
+    if os.path.isdir(recipes_folder):
+        entries = itertools.chain(entries, scan_tree(recipes_folder, exclude=None))
+    for entry, _ in entries:
+        digest = os.path.basename(os.path.dirname(entry.path)) + entry.name
+        if digest.endswith('.json'):
+            digest = digest[:-5]
+        if digest in referenced:
+            continue
+        try:
+            size = entry.stat().st_size
+            if not dry_run:
+                os.remove(entry.path)
+            removed += 1
+            freed += size
+        except OSError as e:
+            logger.warning(Fore.YELLOW + f'Failed to remove object {entry.path}: {e}')
+    logger.info(Fore.BLUE + f'Garbage collection removed {removed} objects ({freed} bytes)')
+    return removed, freed
+
+# Remove one dated snapshot: its browse folder and its tree
+def remove_snapshot(base_path, day):
+    snapshot_folder = os.path.join(base_path, 'Backup', day)
+    if os.path.isdir(snapshot_folder):
+        shutil.rmtree(snapshot_folder)
+    tree_path = os.path.join(base_path, 'Backup', TREES_DIR, day + '.json')
+    if os.path.exists(tree_path):
+        os.remove(tree_path)
+    logger.info(Fore.GREEN + f'Removed backup snapshot {day}')
+
+# Snapshot days kept by a rotation: the newest `daily` days, plus the newest snapshot
+# of each of the last `weekly` ISO weeks and of each of the last `monthly` months
+def snapshots_to_keep(days, keep_days=None, daily=0, weekly=0, monthly=0, today=None):
+    from datetime import date, timedelta
+
+    newest_first = sorted(days, reverse=True)
+    keep = set(newest_first[:daily])
+    for period_count, period_of in ((weekly, lambda d: date.fromisoformat(d).isocalendar()[:2]),
+                                    (monthly, lambda d: d[:7])):
+        periods = []
+        for day in newest_first:
+            period = period_of(day)
+            if period not in periods:
+                if len(periods) == period_count:
+                    break
+                periods.append(period)
+                keep.add(day)
+    if keep_days is not None:
+        cutoff = ((today or date.today()) - timedelta(days=keep_days)).isoformat()
+        keep.update(day for day in days if day >= cutoff)
+    return keep
+
+# Drop snapshots no retention rule keeps, then the blobs only they referenced.
+# Without any rule nothing is removed.
+@instrumented('prune_snapshots')
+def prune_snapshots(base_path, keep_days=None, daily=0, weekly=0, monthly=0, dry_run=False, workers=None):
+    with _backup_lock:
+        days = list_snapshots(base_path)
+        if keep_days is None and not (daily or weekly or monthly):
+            expired = []
+        else:
+            keep = snapshots_to_keep(days, keep_days, daily, weekly, monthly)
+            expired = [day for day in days if day not in keep]
+        if not dry_run:
+            # rmtree of separate snapshot folders is independent work
+            for _ in bounded_map(lambda day: remove_snapshot(base_path, day), expired,
+                                 workers or TRANSFER_WORKERS, 'smartfm-prune'):
+                pass
+        # A dry run keeps the expired trees, so it only reports blobs that are already orphaned
+        removed, freed = collect_garbage(base_path, dry_run=dry_run)
+    return {'snapshots': expired, 'objects_removed': removed, 'bytes_freed': freed}
+
+# Rebuild the tree as it was on a given day into a destination folder
+@instrumented('restore_snapshot')
+def restore_snapshot(base_path, day, destination):
+    tree_path = os.path.join(base_path, 'Backup', TREES_DIR, day + '.json')
+    if not ensure_exists(tree_path):
+        return 0
+
+    if day == backup_day():
+        # Today's tree file lags the watcher; the manifest log has every change since
+        tree = {relative_path: entry['hash'] for relative_path, entry in load_manifest(base_path).items()}
+    else:
+        with open(tree_path, 'r', encoding='utf-8') as f:
+            tree = json.load(f)
+
+    restored = 0
+    engine = TransferEngine()
+
+    # Whole blobs are copied; chunked files are reassembled from their recipe
+    def restore(item):
+        relative_path, digest = item
+        target_path = os.path.join(destination, relative_path)
+        blob = object_path(base_path, digest)
+        if os.path.exists(blob):
+            size = engine.copy(blob, target_path)
+            os.chmod(target_path, stat.S_IMODE(os.stat(target_path).st_mode) | stat.S_IWUSR)
+            return size
+        recipe = load_recipe(base_path, digest)
+        if recipe is None:
+            raise FileNotFoundError(f'No object or recipe for {digest}')
+        engine.ensure_dir(os.path.dirname(target_path))
+        size = restore_chunked(base_path, recipe, target_path)
+        engine._account(size)
+        return size
+
+    # A missing blob means a chunked (large) file, which gets a task of its own
+    def restore_size(item):
+        size = size_of(object_path(base_path, item[1]))
+        return size if size >= 0 else SMALL_FILE_SIZE
+
+    for (relative_path, _), _, error in engine.map(restore, tree.items(), size=restore_size):
+        target_path = os.path.join(destination, relative_path)
+        if error is None:
+            restored += 1
+        else:
+            logger.error(Fore.RED + f'Failed to restore {target_path}: {error}')
+            print(f"Failed to restore {target_path}: {error}")
+
+    print(f"Restored {restored} files from {day} into {destination}")
+    logger.info(Fore.GREEN + f'Restored {restored} files from snapshot {day} into {destination}')
+    return restored
+
+@instrumented('backup_files')
+def backup_files(base_path, progress=None):
+    backup_root = today_backup_root(base_path)
+    # The first backup of a day fills its folder with the whole tree, later ones keep it current
+    new_day = not os.path.isdir(backup_root)
+    folder_check(backup_root)
+    counts = {'copied': 0, 'skipped': 0, 'deleted': 0, 'failed': 0}
+    engine = TransferEngine()
+
+    with _backup_lock:
+        manifest = current_manifest(base_path)
+        # A full scan may delete many keys; delete_subtree() re-sorts when next needed
+        manifest.sorted_keys = None
+        # Shrinks as files are found; it shares the manifest's key strings, so unlike
+        # a set of every path seen it never holds a second copy of the tree
+        unseen = set(manifest)
+        scanned = 0
+
+        def sources():
+            nonlocal scanned
+            for relative_path, source_path, st in iter_backup_sources(base_path):
+                unseen.discard(relative_path)
+                scanned += 1
+                if progress is not None and scanned % 1000 == 0:
+                    progress(scanned)
+                yield relative_path, source_path, st
 
-    if files_backed_up == 0:
+        try:
+            backup_sources(base_path, manifest, sources(), backup_root, counts, engine)
+
+            # Files that disappeared from the tree are dropped from the manifest
+            for relative_path in unseen:
+                if relative_path in manifest:
+                    del manifest[relative_path]
+                    counts['deleted'] += 1
+                    if not new_day:
+                        unlink_snapshot_path(backup_root, relative_path)
+        finally:
+            save_manifest(base_path, manifest)
+            write_snapshot_tree(base_path, manifest)
+        if new_day:
+            link_snapshot_tree(base_path, manifest, backup_root, engine)
+    get_hash_cache(base_path).save()
+
+    copied, skipped, deleted = counts['copied'], counts['skipped'], counts['deleted']
+    if copied == 0 and deleted == 0:
         print("All files already backed up. No new files found.")
         logger.info('No new files backed up.')
+    print(f"Backup complete: {copied} copied, {skipped} skipped, {deleted} deleted.")
+    logger.info(f'Backup summary: copied={copied} skipped={skipped} deleted={deleted}')
+    engine.report('Backup')
+    return counts
+
+# Back up only the given paths (files or folders), as reported by the watcher
+@instrumented('backup_paths')
+def backup_paths(base_path, paths):
+    backup_root = today_backup_root(base_path)
+    # The first backup of a day fills its folder with the whole tree, later ones keep it current
+    new_day = not os.path.isdir(backup_root)
+    folder_check(backup_root)
+    counts = {'copied': 0, 'skipped': 0, 'deleted': 0, 'failed': 0}
+    engine = TransferEngine()
+
+    with _backup_lock:
+        manifest = current_manifest(base_path)
+
+        # Folders already walked in this batch. A folder sorts before everything below it,
+        # so the files and folders a rename reports alongside it are skipped, not stored twice.
+        walked = set()
+
+        def under_walked(relative_path):
+            parent = os.path.dirname(relative_path)
+            while parent:
+                if parent in walked:
+                    return True
+                parent = os.path.dirname(parent)
+            return False
+
+        def sources():
+            for path in sorted(paths):
+                if is_backup_path(base_path, path):
+                    continue
+                relative_path = os.path.relpath(path, base_path)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    # Deleted or moved away: forget it and anything below it
+                    counts['deleted'] += manifest.delete_subtree(relative_path)
+                    unlink_snapshot_path(backup_root, relative_path)
+                    continue
+                except OSError as e:
+                    logger.warning(Fore.YELLOW + f'Cannot stat {path}: {e}')
+                    continue
+
+                if under_walked(relative_path):
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    walked.add(relative_path)
+                    yield from iter_backup_sources(base_path, path)
+                else:
+                    yield relative_path, path, st
+
+        try:
+            backup_sources(base_path, manifest, sources(), backup_root, counts, engine)
+        finally:
+            append_manifest_log(base_path, manifest)
+            # Fold the log back in once it holds more records than the manifest has entries
+            if manifest.logged > max(len(manifest), MANIFEST_LOG_MIN):
+                save_manifest(base_path, manifest)
+        # Later changes of the day stay in the log until checkpoint_backup or a full backup
+        if new_day:
+            write_snapshot_tree(base_path, manifest)
+            link_snapshot_tree(base_path, manifest, backup_root, engine)
+
+    logger.info('Event backup of {} paths: copied={copied} skipped={skipped} deleted={deleted}'.format(len(paths), **counts))
+    return counts
+
+# Fold the watcher's manifest log into manifest.json, refresh today's tree and save the
+# hash cache; run when the watcher stops
+def checkpoint_backup(base_path):
+    with _backup_lock:
+        manifest = current_manifest(base_path)
+        if manifest.logged or manifest.changes:
+            save_manifest(base_path, manifest)
+            write_snapshot_tree(base_path, manifest)
+    get_hash_cache(base_path).save()
+
+# ------------------ Metadata Index ------------------
+
+# SQLite catalog of the managed tree, stored with the backups
+INDEX_NAME = 'index.sqlite'
+INDEX_INSERT_BATCH = 5000
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,   -- relative to the base path
+    parent   TEXT NOT NULL,      -- relative folder ('' for the base path)
+    top      TEXT NOT NULL,      -- first folder under the base path ('' for root files)
+    name     TEXT NOT NULL,
+    category TEXT,
+    size     INTEGER NOT NULL,
+    mtime    REAL NOT NULL,
+    hash     TEXT
+);
+CREATE INDEX IF NOT EXISTS files_category_size ON files (category, size);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+CREATE INDEX IF NOT EXISTS files_parent ON files (parent);
+CREATE INDEX IF NOT EXISTS files_top ON files (top);
+CREATE TABLE IF NOT EXISTS folders (
+    path     TEXT PRIMARY KEY,   -- relative to the base path
+    parent   TEXT NOT NULL,
+    top      TEXT NOT NULL,      -- '' for top-level folders
+    name     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS folders_parent ON folders (parent);
+"""
+
+# On-disk catalog (path, category, size, mtime, hash) that answers listing and search
+# queries without rescanning; the watcher keeps it current through apply_paths()
+class FileIndex:
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.path = os.path.join(base_path, 'Backup', INDEX_NAME)
+        folder_check(os.path.dirname(self.path))
+        import sqlite3
+
+        self.lock = threading.Lock()        # One connection shared by the menu and watcher threads
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(INDEX_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _row(self, relative_path, source_path, st, classifier, cache):
+        parent = os.path.dirname(relative_path)
+        top = relative_path.split(os.sep, 1)[0] if parent else ''
+        return (relative_path, parent, top, os.path.basename(relative_path),
+                classifier.classify(source_path, st), st.st_size, st.st_mtime,
+                cache.get(st, HASH_ALGORITHM))
+
+    def _insert(self, sources):
+        classifier = get_classifier()
+        cache = get_hash_cache(self.base_path)
+        batch = []
+        for relative_path, source_path, st in sources:
+            batch.append(self._row(relative_path, source_path, st, classifier, cache))
+            if len(batch) >= INDEX_INSERT_BATCH:
+                self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                batch.clear()
+        if batch:
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+
+    def _insert_folders(self, folders):
+        rows = []
+        for relative_path in folders:
+            parent = os.path.dirname(relative_path)
+            rows.append((relative_path, parent, relative_path.split(os.sep, 1)[0] if parent else '',
+                         os.path.basename(relative_path)))
+        self.conn.executemany('INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)', rows)
+
+    # Insert a tree (a folder's files and subfolders) found in one walk
+    def _insert_tree(self, start=None, folder=None):
+        folders = [] if folder is None else [folder]
+        self._insert(iter_backup_sources(self.base_path, start, folders))
+        self._insert_folders(folders)
+
+    def _delete_tree(self, relative_path):
+        # Range over the primary key instead of LIKE, so the delete stays indexed
+        prefix = relative_path + os.sep
+        for table in ('files', 'folders'):
+            self.conn.execute(f'DELETE FROM {table} WHERE path = ? OR (path >= ? AND path < ?)',
+                              (relative_path, prefix, relative_path + chr(ord(os.sep) + 1)))
+
+    # Full build with bulk inserts in a single transaction
+    @instrumented('index_rebuild')
+    def rebuild(self):
+        started = time.perf_counter()
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM files')
+            self.conn.execute('DELETE FROM folders')
+            self._insert_tree()
+            count = self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        logger.info(Fore.BLUE + f'Indexed {count} files in {time.perf_counter() - started:.2f}s')
+        return count
+
+    # Refresh the rows for paths reported by the watcher (files or folders, present or gone)
+    def apply_paths(self, paths):
+        with self.lock, self.conn:
+            for path in paths:
+                if is_backup_path(self.base_path, path):
+                    continue
+                relative_path = os.path.relpath(path, self.base_path)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    self._delete_tree(relative_path)
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    self._delete_tree(relative_path)
+                    self._insert_tree(path, relative_path)
+                else:
+                    self._insert([(relative_path, path, st)])
+                    # Folders created along with the file (the order of events is not guaranteed)
+                    parent = os.path.dirname(relative_path)
+                    ancestors = []
+                    while parent:
+                        ancestors.append(parent)
+                        parent = os.path.dirname(parent)
+                    self._insert_folders(ancestors)
+
+    def remove(self, relative_path):
+        with self.lock, self.conn:
+            self._delete_tree(relative_path)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # Files at most one folder deep, as option 2 lists them
+    def shallow_files(self):
+        return self.query('SELECT top, name FROM files WHERE parent = top ORDER BY top, name')
+
+    # (top folder, name) of the first-level subfolders of every top folder (or of one), empty ones too
+    def subfolders(self, top=None):
+        sql = "SELECT top, name FROM folders WHERE parent = top AND top != ''"
+        params = ()
+        if top is not None:
+            sql += ' AND top = ?'
+            params = (top,)
+        return sorted((row['top'], row['name']) for row in self.query(sql, params))
+
+    def top_folders(self):
+        return {row['name'] for row in self.query("SELECT name FROM folders WHERE parent = ''")}
+
+    # Top folders holding at least one file somewhere below them
+    def occupied_folders(self):
+        return {row['top'] for row in self.query("SELECT DISTINCT top FROM files WHERE top != ''")}
+
+    def files_in(self, parent):
+        return self.query('SELECT name FROM files WHERE parent = ? ORDER BY name', (parent,))
+
+    def files_modified_between(self, parent, start, end, recursive=False):
+        if recursive and not parent:
+            return self.query('SELECT path, name, mtime FROM files WHERE mtime > ? AND mtime < ?', (start, end))
+        if not recursive:
+            return self.query('SELECT path, name, mtime FROM files WHERE parent = ? AND mtime > ? AND mtime < ?',
+                              (parent, start, end))
+        return self.query('SELECT path, name, mtime FROM files WHERE (parent = ? OR (parent >= ? AND parent < ?)) '
+                          'AND mtime > ? AND mtime < ?',
+                          (parent, parent + os.sep, parent + chr(ord(os.sep) + 1), start, end))
+
+    # Files of one folder ('' for the base path), optionally with everything below it
+    def listing(self, parent='', recursive=False, category=None, limit=None):
+        sql = 'SELECT path, category, size, mtime, hash FROM files WHERE '
+        if recursive and parent:
+            sql += '(parent = ? OR (parent >= ? AND parent < ?))'
+            params = [parent, parent + os.sep, parent + chr(ord(os.sep) + 1)]
+        elif recursive:
+            sql += '1'
+            params = []
+        else:
+            sql += 'parent = ?'
+            params = [parent]
+        if category:
+            sql += ' AND category = ? COLLATE NOCASE'
+            params.append(category)
+        sql += ' ORDER BY path'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return self.query(sql, params)
+
+    # Flexible search, e.g. largest files in Videos or files modified in the last week
+    def search(self, category=None, name=None, min_size=None, modified_after=None,
+               modified_before=None, order='size', limit=20):
+        clauses, params = [], []
+        if category:
+            clauses.append('category = ? COLLATE NOCASE')
+            params.append(category)
+        if name:
+            clauses.append('name LIKE ?')
+            params.append(f'%{name}%')
+        if min_size is not None:
+            clauses.append('size >= ?')
+            params.append(min_size)
+        if modified_after is not None:
+            clauses.append('mtime >= ?')
+            params.append(modified_after)
+        if modified_before is not None:
+            clauses.append('mtime < ?')
+            params.append(modified_before)
+        order_by = {'size': 'size DESC', 'mtime': 'mtime DESC', 'name': 'name'}.get(order, 'size DESC')
+        sql = 'SELECT path, category, size, mtime, hash FROM files'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f' ORDER BY {order_by} LIMIT ?'
+        return self.query(sql, params + [limit])
+
+    # File count and total bytes per category
+    def stats(self):
+        return self.query("SELECT COALESCE(category, 'Uncategorized') AS category, COUNT(*) AS files, "
+                          'SUM(size) AS bytes FROM files GROUP BY category ORDER BY bytes DESC')
+
+# Print indexed search results
+def search_files(index, **criteria):
+    rows = index.search(**criteria)
+    for row in rows:
+        modified = datetime.fromtimestamp(row['mtime']).strftime('%Y-%m-%d %H:%M')
+        print(f"{row['size']:>14,}  {modified}  {row['category'] or '-':<18} {row['path']}")
+    if not rows:
+        print("No matching files.")
+    return rows
+
+# Print per-category totals from the index
+def index_stats(index):
+    rows = index.stats()
+    total_files = sum(row['files'] for row in rows)
+    total_bytes = sum(row['bytes'] or 0 for row in rows)
+    for row in rows:
+        print(f"{row['category']:<20} {row['files']:>10,} files {row['bytes'] or 0:>18,} bytes")
+    print(f"{'Total':<20} {total_files:>10,} files {total_bytes:>18,} bytes")
+    return rows
 
 # ------------------ Core File Management ------------------
 
@@ -168,37 +1885,70 @@ def store_files(events):
             logger.info(Fore.GREEN + f'{event.fullname} stored successfully.')
 
 # List all files in directories and standalone files
-def get_file(path):
-    dirs = os.listdir(path)
-    if not dirs:
-        print('No directories found.')
-        logger.warning(Fore.RED + 'No directories found.')
+@instrumented('get_file')
+def get_file(path, index=None):
+    if index is not None:
+        rows = index.shallow_files()
+        subfolders = index.subfolders()
+        if not rows and not index.top_folders():
+            print('No directories found.')
+            logger.warning(Fore.RED + 'No directories found.')
+        for d, f in subfolders:
+            print(f'Found: Filename - {f} in directory - {d}')
+        # The Backup folder is never indexed
+        backup_folder = os.path.join(path, BACKUP_DIR)
+        if os.path.isdir(backup_folder):
+            for entry, _ in scan_tree(backup_folder, max_depth=0, exclude=None, dirs=True):
+                print(f'Found: Filename - {entry.name} in directory - {BACKUP_DIR}')
+        for row in rows:
+            if row['top']:
+                print(f"Found: Filename - {row['name']} in directory - {row['top']}")
+            else:
+                print(f"Found: File - {row['name']} (not in a directory)")
         return
-    for d in dirs:
-        full_path = os.path.join(path, d)
-        if os.path.isdir(full_path):
-            for f in os.listdir(full_path):
-                print(f'Found: Filename - {f} in directory - {d}')
-                logger.info(Fore.GREEN + f'Found: Filename - {f} in directory - {d}')
-        else:
-            print(f'Found: File - {d} (not in a directory)')
+
+    found = False
+    for entry, depth in scan_tree(path, max_depth=1, exclude=None, dirs=True):
+        found = True
+        if depth == 1:
+            d = os.path.basename(os.path.dirname(entry.path))
+            print(f'Found: Filename - {entry.name} in directory - {d}')
+            logger.debug(Fore.GREEN + f'Found: Filename - {entry.name} in directory - {d}')
+        elif not entry.is_dir(follow_symlinks=False):
+            print(f'Found: File - {entry.name} (not in a directory)')
             logger.warning(Fore.YELLOW + 'Not in a directory.')
+    if not found:
+        print('No directories found.')
+        logger.warning(Fore.RED + 'No directories found.')
 
 # List only directories from the path
+@instrumented('get_folder')
 def get_folder(path):
     for d in list_dirs(path):
         print(f'Found: Folder - {d}')
 
 # List all files from a specific folder
-def get_file_exact_folder(path, directory):
-    for d in list_dirs(path):
-        if directory.lower() == d.lower():
-            for f in os.listdir(os.path.join(path, d)):
-                print(f'Found: Filename - {f}')
+@instrumented('get_file_exact_folder')
+def get_file_exact_folder(path, directory, index=None):
+    if index is not None:
+        for d in index.top_folders():
+            if directory.lower() == d.lower():
+                for _, f in index.subfolders(d):
+                    print(f'Found: Filename - {f}')
+                for row in index.files_in(d):
+                    print(f"Found: Filename - {row['name']}")
+                return
+        # Not indexed (Backup, or missing): ask the disk
+
+    for entry, _ in scan_tree(path, max_depth=0, exclude=None, files=False, dirs=True):
+        if directory.lower() == entry.name.lower():
+            for child, _ in scan_tree(entry.path, max_depth=0, exclude=None, dirs=True):
+                print(f'Found: Filename - {child.name}')
             return
     print(f"Directory '{directory}' not found.")
 
 # Delete a folder and all its contents
+@instrumented('delete_folder')
 def delete_folder(path, folder_name):
     for d in list_dirs(path):
         if folder_name.lower() == d.lower():
@@ -215,7 +1965,8 @@ def delete_folder(path, folder_name):
     print(f"Folder '{folder_name}' not found in {path}")
 
 # Delete files between two dates inside a specific folder
-def old_file_clean(path, time_str_s, time_str_e, directory):
+@instrumented('old_file_clean')
+def old_file_clean(path, time_str_s, time_str_e, directory, index=None, recursive=False):
     try:
         cutoff_start = datetime.strptime(time_str_s, '%Y-%m-%d').timestamp()
         cutoff_end = datetime.strptime(time_str_e, '%Y-%m-%d').timestamp()
@@ -231,110 +1982,1677 @@ def old_file_clean(path, time_str_s, time_str_e, directory):
     files_deleted = 0
     print(f"Checking files in: {full_path}")
 
-    for file in os.listdir(full_path):
-        file_path = os.path.join(full_path, file)
-        if os.path.isfile(file_path):
-            try:
-                mod_time = os.path.getmtime(file_path)
-                if cutoff_start < mod_time < cutoff_end:
-                    os.remove(file_path)
-                    print(f"Deleted: {file}")
-                    files_deleted += 1
-                    logger.info(Fore.GREEN + f'Deleted: {file}. Time Stamped: {mod_time}')
-            except Exception as e:
-                logger.exception(Fore.RED + 'Failed to delete file')
-                print(f"Skipped {file}: {e}")
+    if index is not None:
+        candidates = clean_indexed(index, directory, cutoff_start, cutoff_end, recursive=recursive)
+    else:
+        candidates = clean_files_between(full_path, cutoff_start, cutoff_end, recursive=recursive, base_path=path)
+
+    for _, name, mod_time, error in candidates:
+        if error is None:
+            print(f"Deleted: {name}")
+            files_deleted += 1
+            logger.debug(Fore.GREEN + f'Deleted: {name}. Time Stamped: {mod_time}')
+        else:
+            logger.error(Fore.RED + f'Failed to delete file {name}: {error}')
+            print(f"Skipped {name}: {error}")
 
     print(f"Total files deleted: {files_deleted}" if files_deleted else "No files deleted.")
 
+# clean_files_between() driven by the index: it names the candidates and each one is
+# re-checked on disk before deleting; yields (path, name, mtime, error)
+def clean_indexed(index, directory, cutoff_start, cutoff_end, dry_run=False, recursive=False):
+    parent = os.path.normpath(directory) if directory else ''
+    if parent == '.':
+        parent = ''
+    for row in index.files_modified_between(parent, cutoff_start, cutoff_end, recursive):
+        file_path = os.path.join(index.base_path, row['path'])
+        try:
+            mod_time = os.stat(file_path).st_mtime
+            if cutoff_start < mod_time < cutoff_end:
+                if not dry_run:
+                    os.remove(file_path)
+                    index.remove(row['path'])
+                yield file_path, row['name'], mod_time, None
+        except FileNotFoundError:
+            index.remove(row['path'])
+        except Exception as e:
+            yield file_path, row['name'], None, e
+
+# Delete the files of a folder (and its subfolders if recursive) modified strictly between
+# two timestamps, or only report them with dry_run; yields (path, name, mtime, error)
+def clean_files_between(full_path, cutoff_start, cutoff_end, dry_run=False, recursive=False, base_path=None):
+    exclude = backup_exclude(base_path, full_path) if recursive and base_path is not None else None
+    for entry, _ in scan_tree(full_path, max_depth=None if recursive else 0, exclude=exclude):
+        try:
+            mod_time = entry.stat().st_mtime
+            if cutoff_start < mod_time < cutoff_end:
+                if not dry_run:
+                    os.remove(entry.path)
+                yield entry.path, entry.name, mod_time, None
+        except Exception as e:
+            yield entry.path, entry.name, None, e
+
 # Delete folders that are empty
-def delete_if_empty(path):
-    for d in list_dirs(path):
-        full_path = os.path.join(path, d)
-        if not os.listdir(full_path):  # Folder is empty
-            delete_folder(path, d)
+@instrumented('delete_if_empty')
+def delete_if_empty(path, index=None):
+    # Folders holding indexed files are certainly not empty and are not opened at all
+    occupied = index.occupied_folders() if index is not None else set()
+    for entry, _ in scan_tree(path, max_depth=0, exclude=None, files=False, dirs=True):
+        try:
+            if entry.name not in occupied and is_empty_dir(entry.path):
+                os.rmdir(entry.path)
+                print(f"Deleted folder and all contents: {entry.name}")
+                logger.info(Fore.GREEN + f"Deleted folder and all contents: {entry.name}")
+        except OSError as e:
+            logger.exception(Fore.RED + 'Failed to delete empty folder:')
+            print(f"Failed to delete folder {entry.name}: {e}")
 # ------------------ Advanced Utilities ------------------
 
 def preview_files(file_list):
     for i, file in enumerate(file_list):
         print(f"[{i+1}] {file}")
-        logger.info('Previewing file {}'.format(file))
+        logger.debug('Previewing file {}'.format(file))
     confirm = input("Proceed with action on these files? (y/n): ")
     return confirm.lower() == 'y'
 
 
-def hash_file(filepath, chunk_size=4096):
-    sha256 = hashlib.sha256()
+# ------------------ Hashing Engine ------------------
+
+# Default digest, buffer sizes and worker count; overridable from the environment (.env)
+HASH_ALGORITHM = 'sha256'
+HASH_BUFFER_SIZE = 1024 * 1024
+HASH_MMAP_THRESHOLD = 64 * 1024 * 1024
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+HASH_CACHE_NAME = 'hash_cache.json'
+HASH_CACHE_LIMIT = 1_000_000
+
+# One reusable read buffer per thread, so hashing never allocates per chunk
+_hash_buffers = threading.local()
+
+def _hash_buffer(size):
+    buf = getattr(_hash_buffers, 'buf', None)
+    if buf is None or len(buf) != size:
+        buf = bytearray(size)
+        _hash_buffers.buf = buf
+    return buf
+
+# Algorithms usable for file hashing (variable-length shake digests are excluded)
+def hash_algorithms():
+    return sorted(a for a in hashlib.algorithms_available if not a.startswith('shake'))
+
+@instrumented('hash_file')
+def hash_file(filepath, chunk_size=HASH_BUFFER_SIZE, algorithm=None):
+    hasher = hashlib.new(algorithm or HASH_ALGORITHM)
+
+    with open(filepath, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= HASH_MMAP_THRESHOLD:
+            # Large files: let the kernel page the file in, no copies into Python buffers
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, chunk_size):
+                        hasher.update(view[offset:offset + chunk_size])
+        else:
+            buf = _hash_buffer(chunk_size)
+            with memoryview(buf) as view:
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    hasher.update(view[:n])
+    metrics.inc('smartfm_bytes_hashed_total', size)
+    logger.debug(Fore.CYAN + f'File {filepath} has been hashed')
+    return hasher.hexdigest()
+
+# Persistent digests keyed by (algorithm, device, inode, size, mtime_ns): unchanged files are never re-read
+class HashCache:
+    def __init__(self, path=None):
+        self.path = path                    # JSON file backing the cache (None = memory only)
+        self.entries = {}                   # Cache key -> hex digest
+        self.lock = threading.Lock()
+        self.dirty = False
+        if path:
+            self.load()
+
+    @staticmethod
+    def key(st, algorithm):
+        return f'{algorithm}:{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}'
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(Fore.YELLOW + f'Hash cache unreadable, starting empty: {e}')
+
+    def get(self, st, algorithm):
+        return self.entries.get(self.key(st, algorithm))
+
+    def put(self, st, algorithm, digest):
+        with self.lock:
+            self.entries[self.key(st, algorithm)] = digest
+            self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        with self.lock:
+            # Keep the newest entries when the cache outgrows its limit
+            if len(self.entries) > HASH_CACHE_LIMIT:
+                overflow = len(self.entries) - HASH_CACHE_LIMIT
+                self.entries = dict(list(self.entries.items())[overflow:])
+            folder_check(os.path.dirname(self.path))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+_hash_caches = {}
+
+# Shared hash cache stored next to the backups of a base path. Ad-hoc callers pass
+# managed=False: the cache is then only persisted where a Backup folder already exists,
+# so hashing an arbitrary folder never leaves a Backup/ behind in it.
+def get_hash_cache(base_path, managed=True):
+    key = os.path.abspath(base_path)
+    if key not in _hash_caches:
+        backup_root = os.path.join(key, BACKUP_DIR)
+        if not managed and not os.path.isdir(backup_root):
+            return _hash_caches.setdefault(('memory', key), HashCache())
+        _hash_caches[key] = HashCache(os.path.join(backup_root, HASH_CACHE_NAME))
+    return _hash_caches[key]
+
+# Hash one file, answering from the cache when its stat signature is unchanged
+def cached_hash(filepath, cache=None, algorithm=None):
+    algorithm = algorithm or HASH_ALGORITHM
+    if cache is None:
+        return hash_file(filepath, algorithm=algorithm)
+    st = os.stat(filepath)
+    digest = cache.get(st, algorithm)
+    metrics.inc('smartfm_hash_cache_total', result='miss' if digest is None else 'hit')
+    if digest is None:
+        digest = hash_file(filepath, algorithm=algorithm)
+        cache.put(st, algorithm, digest)
+    return digest
+
+# Run func over items on a thread pool with a bounded number of queued futures,
+# so huge inputs stream through; yields results in completion order
+def bounded_map(func, items, workers, name='smartfm-worker'):
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        in_flight = set()
+        for item in items:
+            in_flight.add(pool.submit(func, item))
+            if len(in_flight) >= workers * 4:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(in_flight):
+            yield future.result()
+
+# Hash many files concurrently (hashlib releases the GIL); yields (path, digest) as they finish
+def iter_file_hashes(paths, algorithm=None, cache=None, workers=None):
+    def work(filepath):
+        try:
+            return filepath, cached_hash(filepath, cache, algorithm)
+        except OSError as e:
+            logger.warning(Fore.YELLOW + f'Failed to hash {filepath}: {e}')
+            return filepath, None
+
+    yield from bounded_map(work, paths, workers or HASH_WORKERS, 'smartfm-hash')
+
+# Hash many files concurrently; returns {path: digest} for the files that could be read
+def hash_files(paths, algorithm=None, cache=None, workers=None):
+    return {
+        filepath: digest
+        for filepath, digest in iter_file_hashes(paths, algorithm, cache, workers)
+        if digest is not None
+    }
+
+
+# ------------------ Duplicate Finder ------------------
+
+# Bytes sampled from each end of a file before paying for a full hash
+DUPLICATE_SAMPLE_SIZE = 4 * 1024
+# Candidate files handled per pipeline round, so results stream out as they are found
+DUPLICATE_CHUNK_FILES = 2000
 
+# Hash the first and last few KiB of a file: a cheap filter before hash_file
+def partial_hash(filepath, size, sample=DUPLICATE_SAMPLE_SIZE):
+    hasher = hashlib.blake2b(digest_size=16)
     with open(filepath, 'rb') as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            sha256.update(chunk)
-    logger.info(Fore.CYAN + 'File has been hashed')
-    return sha256.hexdigest()
+        hasher.update(f.read(sample))
+        if size > sample:
+            f.seek(max(size - sample, sample))
+            hasher.update(f.read(sample))
+    return hasher.hexdigest()
+
+# Stage 2 and 3 for a chunk of same-size groups: partial hash, then full hash of survivors.
+# Yields (digest, size, [paths]) for every confirmed group.
+def _confirm_duplicates(size_groups, cache, workers):
+    def sample(item):
+        size, filepath = item
+        try:
+            return size, filepath, partial_hash(filepath, size)
+        except OSError as e:
+            logger.warning(Fore.YELLOW + f'Failed to read {filepath}: {e}')
+            return size, filepath, None
+
+    by_sample = {}
+    items = ((size, filepath) for size, paths in size_groups for filepath in paths)
+    for size, filepath, digest in bounded_map(sample, items, workers, 'smartfm-dupes'):
+        if digest is not None:
+            by_sample.setdefault((size, digest), []).append(filepath)
+
+    colliding = [(size, paths) for (size, _), paths in by_sample.items() if len(paths) > 1]
+    full = hash_files((p for _, paths in colliding for p in paths), cache=cache, workers=workers)
+
+    for size, paths in colliding:
+        by_hash = {}
+        for filepath in paths:
+            if filepath in full:
+                by_hash.setdefault(full[filepath], []).append(filepath)
+        for digest, group in by_hash.items():
+            if len(group) > 1:
+                yield digest, size, sorted(group)
+
+# Find groups of identical files under base_path: size -> head/tail sample -> full hash.
+# Groups are yielded as soon as each chunk of candidates is confirmed.
+def find_duplicates(base_path, min_size=1, workers=None):
+    workers = workers or HASH_WORKERS
+    cache = get_hash_cache(base_path, managed=False)
+
+    # Stage 1: group by size; paths sharing an inode are already one copy on disk
+    by_size = {}
+    seen_inodes = set()
+    for _, source_path, st in iter_backup_sources(base_path):
+        if st.st_size < min_size or (st.st_dev, st.st_ino) in seen_inodes:
+            continue
+        seen_inodes.add((st.st_dev, st.st_ino))
+        by_size.setdefault(st.st_size, []).append(source_path)
+    del seen_inodes
+
+    # Largest sizes first: they free the most space
+    chunk, chunk_files = [], 0
+    for size in sorted((s for s, paths in by_size.items() if len(paths) > 1), reverse=True):
+        chunk.append((size, by_size.pop(size)))
+        chunk_files += len(chunk[-1][1])
+        if chunk_files >= DUPLICATE_CHUNK_FILES:
+            yield from _confirm_duplicates(chunk, cache, workers)
+            chunk, chunk_files = [], 0
+    if chunk:
+        yield from _confirm_duplicates(chunk, cache, workers)
+    cache.save()
+
+# Print duplicate groups as they are found; returns (digest, paths) pairs for resolve_duplicates
+@instrumented('report_duplicates')
+def report_duplicates(base_path):
+    groups = []
+    wasted = 0
+    for digest, size, group in find_duplicates(base_path):
+        groups.append((digest, group))
+        wasted += size * (len(group) - 1)
+        print(f"Duplicate set {len(groups)} ({size} bytes, {digest[:12]}):")
+        for filepath in group:
+            print(f"    {filepath}")
+    if groups:
+        print(f"Found {len(groups)} duplicate sets, {wasted} bytes reclaimable.")
+    else:
+        print("No duplicate files found.")
+    logger.info(Fore.CYAN + f'Duplicate scan of {base_path}: {len(groups)} sets, {wasted} bytes reclaimable')
+    return groups
+
+def size_of(filepath):
+    try:
+        return os.stat(filepath).st_size
+    except OSError:
+        return -1
+
+# Replace every copy but the first of each (digest, paths) group with a hardlink, or delete it,
+# after confirmation. Both files are re-hashed first (a cache hit when they are unchanged),
+# so a file rewritten since the scan is never destroyed.
+@instrumented('resolve_duplicates')
+def resolve_duplicates(groups, action='hardlink', confirm=True, cache=None):
+    targets = [(digest, group[0], duplicate) for digest, group in groups for duplicate in group[1:]]
+    if not targets or (confirm and not preview_files([duplicate for _, _, duplicate in targets])):
+        print("No changes made.")
+        return 0
+
+    def unchanged(filepath, digest):
+        try:
+            return cached_hash(filepath, cache) == digest
+        except OSError:
+            return False
+
+    resolved = 0
+    for digest, keeper, duplicate in targets:
+        try:
+            if not unchanged(keeper, digest) or not unchanged(duplicate, digest):
+                print(f"Skipped {duplicate}: it changed since the scan.")
+                continue
+            if action == 'delete':
+                os.remove(duplicate)
+            else:
+                # Link beside the duplicate, then swap it in atomically
+                tmp_path = duplicate + '.smartfm-link'
+                os.link(keeper, tmp_path)
+                os.replace(tmp_path, duplicate)
+            resolved += 1
+            logger.debug(Fore.GREEN + f'{action}: {duplicate} -> {keeper}')
+        except OSError as e:
+            logger.exception(Fore.RED + f'Failed to {action} duplicate {duplicate}')
+            print(f"Failed to {action} {duplicate}: {e}")
+
+    print(f"{resolved} duplicates {'deleted' if action == 'delete' else 'hardlinked'}.")
+    return resolved
+
+
+# ------------------ Classification Engine ------------------
+
+# Optional user rules (JSON); see Classifier for the supported keys
+RULES_FILE = os.path.join(os.path.expanduser('~'), '.smartfm_rules.json')
+
+# Extensions listed in more than one category resolve explicitly instead of by dict order
+EXTENSION_OVERRIDES = {
+    '.sh': 'Scripts',
+    '.bat': 'Scripts',
+    '.js': 'Scripts',
+}
 
+# Content signatures for files without an extension: (offset, magic bytes, category)
+MAGIC_SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'Pictures'),
+    (0, b'\xff\xd8\xff', 'Pictures'),
+    (0, b'GIF8', 'Pictures'),
+    (0, b'%PDF', 'Documents'),
+    (0, b'PK\x03\x04', 'Archives'),
+    (0, b'\x1f\x8b', 'Archives'),
+    (0, b'BZh', 'Archives'),
+    (0, b'\xfd7zXZ\x00', 'Archives'),
+    (0, b"7z\xbc\xaf'\x1c", 'Archives'),
+    (0, b'Rar!', 'Archives'),
+    (0, b'\x7fELF', 'Executables'),
+    (0, b'MZ', 'Executables'),
+    (0, b'SQLite format 3\x00', 'Databases'),
+    (0, b'ID3', 'Audios'),
+    (0, b'OggS', 'Audios'),
+    (0, b'fLaC', 'Audios'),
+    (8, b'WAVE', 'Audios'),
+    (8, b'AVI ', 'Videos'),
+    (4, b'ftyp', 'Videos'),
+    (0, b'\x1aE\xdf\xa3', 'Videos'),
+    (0, b'#!', 'Scripts'),
+]
+MAGIC_READ_SIZE = max(offset + len(magic) for offset, magic, _ in MAGIC_SIGNATURES)
+
+# A user rule: every condition that is set must match for the rule to apply
+class ClassificationRule:
+    def __init__(self, spec):
+        self.category = spec['category']
+        self.extensions = {e.lower() for e in spec.get('extensions', [])} or None
+        self.pattern = None
+        if 'glob' in spec:
+            self.pattern = re.compile(fnmatch.translate(spec['glob']), re.IGNORECASE)
+        elif 'regex' in spec:
+            self.pattern = re.compile(spec['regex'])
+        self.min_size = spec.get('min_size')
+        self.max_size = spec.get('max_size')
+        self.min_age = spec['min_age_days'] * 86400 if 'min_age_days' in spec else None
+        self.max_age = spec['max_age_days'] * 86400 if 'max_age_days' in spec else None
+        self.magic = bytes.fromhex(spec['magic']) if 'magic' in spec else None
+        self.needs_stat = any(v is not None for v in (self.min_size, self.max_size, self.min_age, self.max_age))
+
+    def matches(self, name, ext, stat_of, head_of, now):
+        if self.extensions is not None and ext not in self.extensions:
+            return False
+        if self.pattern is not None and not self.pattern.match(name):
+            return False
+        if self.needs_stat:
+            st = stat_of()
+            if st is None:
+                return False
+            age = now - st.st_mtime
+            if self.min_size is not None and st.st_size < self.min_size:
+                return False
+            if self.max_size is not None and st.st_size > self.max_size:
+                return False
+            if self.min_age is not None and age < self.min_age:
+                return False
+            if self.max_age is not None and age > self.max_age:
+                return False
+        if self.magic is not None and not head_of().startswith(self.magic):
+            return False
+        return True
 
-# ------------------ File Sorting and Moving ------------------
+# Read the first few bytes of a file for content sniffing
+def read_head(path, size=MAGIC_READ_SIZE):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(size)
+    except OSError:
+        return b''
+
+# Extension -> category index compiled once, plus ordered user rules and magic-byte sniffing.
+# Rules file format: {"rules": [{"category": "Invoices", "glob": "invoice_*.pdf"},
+#   {"category": "Old_Logs", "extensions": [".log"], "min_age_days": 30}, ...]}
+# Supported keys: extensions, glob, regex, min_size, max_size, min_age_days, max_age_days, magic (hex).
+class Classifier:
+    def __init__(self, categories=None, rules=(), overrides=None, sniff=True):
+        categories = FILE_CATEGORIES if categories is None else categories
+        self.index = {}
+        for category, extensions in categories.items():
+            for ext in extensions:
+                self.index.setdefault(ext, category)
+        self.index.update(EXTENSION_OVERRIDES if overrides is None else overrides)
+        self.rules = [ClassificationRule(spec) for spec in rules]
+        self.sniff = sniff
+        self.categories = list(categories)
+        for rule in self.rules:
+            if rule.category not in self.categories:
+                self.categories.append(rule.category)
+
+    # Category for a file path, or None; st may be passed in to avoid a stat call
+    def classify(self, path, st=None):
+        name = os.path.basename(path)
+        ext = os.path.splitext(name)[1].lower()
+
+        if self.rules:
+            cached = {}
+
+            def stat_of():
+                if 'st' not in cached:
+                    try:
+                        cached['st'] = st or os.stat(path)
+                    except OSError:
+                        cached['st'] = None
+                return cached['st']
+
+            def head_of():
+                if 'head' not in cached:
+                    cached['head'] = read_head(path)
+                return cached['head']
+
+            now = time.time()
+            for rule in self.rules:
+                if rule.matches(name, ext, stat_of, head_of, now):
+                    return rule.category
+
+        category = self.index.get(ext)
+        if category is None and not ext and self.sniff:
+            category = self.sniff_category(path)
+        return category
+
+    @staticmethod
+    def sniff_category(path):
+        head = read_head(path)
+        for offset, magic, category in MAGIC_SIGNATURES:
+            if head[offset:offset + len(magic)] == magic:
+                return category
+        return None
+
+# Load user classification rules; a missing file means no rules
+def load_rules(path=None):
+    path = path or RULES_FILE
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('rules', [])
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(Fore.YELLOW + f'Ignoring unreadable rules file {path}: {e}')
+        return []
+
+_classifier = None
+
+# Shared classifier built from FILE_CATEGORIES and the rules file on first use
+def get_classifier():
+    global _classifier
+    if _classifier is None:
+        try:
+            _classifier = Classifier(rules=load_rules())
+        except (KeyError, ValueError, re.error) as e:
+            logger.warning(Fore.YELLOW + f'Invalid classification rule, using extensions only: {e}')
+            _classifier = Classifier()
+    return _classifier
+
+# ------------------ Move Planner ------------------
+
+# Sorting runs build the whole plan first, write it to a journal in Backup/, then move in
+# batches. A journal left behind by a crash is resumed or rolled back on the next start.
+MOVE_JOURNAL_NAME = 'moves.journal'
+MOVE_JOURNAL_VERSION = 1
+MOVE_BATCH_SIZE = 256
+
+# Planned moves grouped by target folder; targets that collide get a " (n)" suffix
+class MovePlan:
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.groups = {}                    # Target folder -> [(source, target, category, size, cross_device)]
+        self.taken = {}                     # Target folder -> names already used there
+        self.devices = {}                   # Target folder -> st_dev of the folder (or its nearest parent)
+        self.source_devices = {}            # Source folder -> st_dev, for sizes that came from a scan
 
-# Categorize files based on their extensions
-def detect_files(files):
-    categorized = {category: [] for category in FILE_CATEGORIES}
-    for file in files:
-        ext = os.path.splitext(file)[1].lower()
-        for category, extensions in FILE_CATEGORIES.items():
-            if ext in extensions:
-                categorized[category].append(file)
+    def _folder_state(self, folder):
+        if folder not in self.taken:
+            try:
+                self.taken[folder] = set(os.listdir(folder))
+            except FileNotFoundError:
+                self.taken[folder] = set()
+            probe = folder
+            while not os.path.exists(probe) and os.path.dirname(probe) != probe:
+                probe = os.path.dirname(probe)
+            self.devices[folder] = os.stat(probe).st_dev
+        return self.taken[folder], self.devices[folder]
+
+    # size, when the caller already has it (a FileCatalog row), saves a stat per file:
+    # the device is then read once per source folder
+    def add(self, source, folder, category=None, size=None):
+        taken, device = self._folder_state(folder)
+        name = os.path.basename(source)
+        stem, extension = os.path.splitext(name)
+        n = 1
+        while name in taken:
+            name = f'{stem} ({n}){extension}'
+            n += 1
+        if size is None:
+            st = os.stat(source)
+            size, source_device = st.st_size, st.st_dev
+        else:
+            source_folder = os.path.dirname(source)
+            source_device = self.source_devices.get(source_folder)
+            if source_device is None:
+                source_device = self.source_devices[source_folder] = os.stat(source_folder).st_dev
+        taken.add(name)
+        target = os.path.join(folder, name)
+        self.groups.setdefault(folder, []).append((source, target, category, size, source_device != device))
+        return target
+
+    @property
+    def moves(self):
+        return [move for group in self.groups.values() for move in group]
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups.values())
+
+    # (start, end) index ranges of plan.moves; never spans two folders, and large
+    # cross-device copies get a batch of their own so they run in parallel
+    def batches(self):
+        start = 0
+        for group in self.groups.values():
+            batch_start = start
+            for i, (_, _, _, size, cross_device) in enumerate(group, start):
+                if cross_device and size >= SMALL_FILE_SIZE:
+                    if i > batch_start:
+                        yield batch_start, i
+                    yield i, i + 1
+                    batch_start = i + 1
+                elif i + 1 - batch_start >= MOVE_BATCH_SIZE:
+                    yield batch_start, i + 1
+                    batch_start = i + 1
+            start += len(group)
+            if start > batch_start:
+                yield batch_start, start
+
+# Plan the moves of a detect_files() result into category folders under base_path
+def plan_sort(base_path, categorized):
+    plan = MovePlan(base_path)
+    for category, file_list in categorized.items():
+        folder = os.path.join(base_path, category)
+        # A scanned catalog already holds the sizes
+        if isinstance(file_list, CatalogView) and file_list.catalog.has_stat:
+            files = ((record.path, record.size) for record in file_list.records())
+        else:
+            files = ((file, None) for file in file_list)
+        for file, size in files:
+            try:
+                plan.add(file, folder, category, size)
+            except OSError as e:
+                logger.warning(Fore.YELLOW + f'Skipping {file}: {e}')
+    return plan
+
+def move_journal_path(base_path):
+    return os.path.join(base_path, 'Backup', MOVE_JOURNAL_NAME)
+
+# Write-ahead journal: a header, one [source, target, cross_device] line per move (relative to
+# the base path), then {"done": [start, end], "failed": [...]} per finished batch. It is
+# deleted once every batch has run.
+class MoveJournal:
+    def __init__(self, path, f=None):
+        self.path = path
+        self.f = f
+
+    @classmethod
+    def create(cls, base_path, moves):
+        path = move_journal_path(base_path)
+        if os.path.exists(path):
+            raise RuntimeError(f'An unfinished move journal exists ({path}); resume or roll it back first')
+        folder_check(os.path.dirname(path))
+        f = open(path, 'w', encoding='utf-8')
+        f.write(json.dumps({'version': MOVE_JOURNAL_VERSION, 'base': base_path, 'moves': len(moves)}) + '\n')
+        for source, target, _, _, cross_device in moves:
+            f.write(json.dumps([os.path.relpath(source, base_path), os.path.relpath(target, base_path),
+                                int(cross_device)], separators=(',', ':')) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        return cls(path, f)
+
+    def record(self, start, end, failed=()):
+        record = {'done': [start, end]}
+        if failed:
+            record['failed'] = list(failed)
+        self.f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.f.flush()
+
+    def finish(self):
+        self.f.close()
+        os.remove(self.path)
+
+    # Returns (moves as [source, target, cross_device] with absolute paths, indexes done,
+    # indexes that failed when they ran), or None when there is no journal. A torn last
+    # line from a crash is ignored.
+    @staticmethod
+    def load(base_path):
+        path = move_journal_path(base_path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return None
+        moves, done, failed = [], set(), set()
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
                 break
-    return categorized
+            if isinstance(record, list):
+                source, target, cross_device = record
+                moves.append((os.path.join(base_path, source), os.path.join(base_path, target), bool(cross_device)))
+            else:
+                start, end = record['done']
+                failed.update(record.get('failed', ()))
+                done.update(set(range(start, end)) - failed)
+        return moves, done, failed
+
+# Run a plan: same-device moves are renames, cross-device ones copy+unlink on the pool.
+# Yields (source, target, category, error) in plan order of each finished batch.
+def execute_moves(plan, engine=None):
+    engine = engine or TransferEngine()
+    moves = plan.moves
+    if not moves:
+        return
+    journal = MoveJournal.create(plan.base_path, moves)
+    for folder in plan.groups:
+        engine.ensure_dir(folder)
+
+    def run_batch(bounds):
+        start, end = bounds
+        errors = []
+        for source, target, _, _, _ in moves[start:end]:
+            try:
+                engine.move(source, target)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return start, end, errors
+
+    for start, end, errors in bounded_map(run_batch, plan.batches(), engine.workers, 'smartfm-move'):
+        journal.record(start, end, [i for i, error in enumerate(errors, start) if error is not None])
+        for (source, target, category, _, _), error in zip(moves[start:end], errors):
+            yield source, target, category, error
+    journal.finish()
+
+# Finish (resume) or undo (rollback) the moves of an interrupted run using its journal, or
+# drop the journal without touching any file (discard).
+# Each move is checked against the disk, so moves done after the last journal record count.
+# Moves the journal lists as failed were already reported when they ran and are left as they are.
+# Returns {'moved': n, 'restored': n, 'failed': n}, or None when there is nothing to recover.
+@instrumented('recover_moves')
+def recover_moves(base_path, action='resume', engine=None):
+    loaded = MoveJournal.load(base_path)
+    if loaded is None:
+        return None
+    moves, done, failed = loaded
+    engine = engine or TransferEngine()
+    counts = {'moved': 0, 'restored': 0, 'failed': 0}
+    if action == 'discard':
+        os.remove(move_journal_path(base_path))
+        logger.warning(Fore.YELLOW + f'Move journal discarded with {len(moves) - len(done)} moves unsettled')
+        return counts
+
+    def recover(item):
+        i, (source, target, cross_device) = item
+        if i in failed:
+            return None
+        source_there, target_there = os.path.lexists(source), os.path.lexists(target)
+        # Both present after a cross-device move means the copy was cut short
+        if source_there and target_there and cross_device:
+            os.remove(target)
+            target_there = False
+        if action == 'rollback':
+            if target_there and not source_there:
+                engine.move(target, source)
+                return 'restored'
+            return None
+        if source_there and not target_there:
+            engine.move(source, target)
+            return 'moved'
+        if not source_there and target_there:
+            return None if i in done else 'moved'
+        raise FileNotFoundError(f'Cannot resume move of {source} to {target}')
+
+    for (_, (source, target, _)), result, error in engine.map(recover, enumerate(moves)):
+        if error is not None:
+            counts['failed'] += 1
+            logger.error(Fore.RED + f'Could not {action} move {source} -> {target}: {error}')
+        elif result:
+            counts[result] += 1
+    if counts['failed'] == 0:
+        os.remove(move_journal_path(base_path))
+    logger.info(Fore.GREEN + f'Move journal {action}: {counts}')
+    return counts
 
-# List all files (not folders) from the given path
+# ------------------ File Sorting and Moving ------------------
+
+# Categorize files based on their extensions and the user rules.
+# Takes a FileCatalog or paths; returns {category: CatalogView of its files}.
+@instrumented('detect_files')
+def detect_files(files, classifier=None):
+    if not isinstance(files, FileCatalog):
+        files = FileCatalog.from_paths(files)
+    return files.by_category(classifier)
+
+# Catalog of all files (not folders) in the given path
 def analysis_file_from_folder(path):
     try:
-        return [
-            os.path.join(path, f)
-            for f in os.listdir(path)
-            if os.path.isfile(os.path.join(path, f))
-        ]
+        return FileCatalog.scan(path)
     except Exception as e:
         print(f"Error reading folder: {e}")
-        return []
+        return FileCatalog()
 
-# Move files into their category folder (Documents, Videos, etc.)
-def move_files(file_list, folder, base_path):
-    target_folder = os.path.join(base_path, folder)
-    os.makedirs(target_folder, exist_ok=True)
-    for file in file_list:
-        try:
-            shutil.move(file, target_folder)
-            logger.info(Fore.YELLOW + f'Moved {file} to {target_folder}')
-        except Exception as e:
-            logger.exception(Fore.RED + 'Failed to move file!')
-            print(f"Failed to move {file}: {e}")
+# Run a sort plan, logging each move; yields (source, target, category, error)
+def run_sort_plan(plan, engine):
+    for source, target, category, error in execute_moves(plan, engine):
+        if error is None:
+            logger.debug(Fore.YELLOW + f'Moved {source} to {target}')
+        else:
+            logger.error(Fore.RED + f'Failed to move file {source}: {error}')
+            print(f"Failed to move {source}: {error}")
+        yield source, target, category, error
 
-# Detect file categories and move them automatically
+# Move files into their category folder (Documents, Videos, etc.)
+@instrumented('move_files')
+def move_files(file_list, folder, base_path, engine=None):
+    plan = plan_sort(base_path, {folder: file_list})
+    return [(source, target, error)
+            for source, target, _, error in run_sort_plan(plan, engine or TransferEngine())]
+
+# Detect file categories and move them automatically, as one journaled plan
+@instrumented('move_file_alternate_destination')
 def move_file_alternate_destination(path):
     try:
         files = analysis_file_from_folder(path)
-        categorized = detect_files(files)
-        for category, file_list in categorized.items():
-            move_files(file_list, category, path)
-            logger.info(Fore.GREEN + f'Moved {file_list} to {category} successfully!')
+        plan = plan_sort(path, detect_files(files))
+        engine = TransferEngine()
+        for _ in run_sort_plan(plan, engine):
+            pass
+        logger.debug(Fore.GREEN + f'Sorted {len(plan)} files into {len(plan.groups)} folders')
+        engine.report('Sort')
         return True
     except Exception as ex:
         print(f"Error moving files: {ex}")
         return False
 
+# ------------------ Retention Engine ------------------
+
+# Declarative cleanup policies (JSON), e.g.
+# {"categories": {"Logs": {"max_age_days": 30},
+#                 "Backups": {"start": "2020-01-01", "end": "2024-01-01"},
+#                 "*": {"max_age_days": 3650}},
+#  "snapshots": {"keep_days": 7, "daily": 7, "weekly": 4, "monthly": 12}}
+# A category policy applies to every file of that category anywhere in the tree ("*" to the rest).
+RETENTION_FILE = os.path.join(os.path.expanduser('~'), '.smartfm_retention.json')
+RETENTION_DELETE_BATCH = 256
+
+# Parse a YYYY-MM-DD day into a timestamp
+def parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').timestamp()
+
+# When files expire: older than max_age_days and/or modified inside [start, end)
+class RetentionPolicy:
+    def __init__(self, spec):
+        self.max_age = spec['max_age_days'] * 86400 if 'max_age_days' in spec else None
+        self.start = parse_day(spec['start']) if 'start' in spec else None
+        self.end = parse_day(spec['end']) if 'end' in spec else None
+
+    def expired(self, mtime, now):
+        if self.max_age is None and self.start is None and self.end is None:
+            return False
+        if self.max_age is not None and now - mtime <= self.max_age:
+            return False
+        if self.start is not None and mtime < self.start:
+            return False
+        if self.end is not None and mtime >= self.end:
+            return False
+        return True
+
+# Load the retention policy file; a missing file means nothing is ever removed
+def load_retention(path=None):
+    path = path or RETENTION_FILE
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(Fore.YELLOW + f'Ignoring unreadable retention file {path}: {e}')
+        return {}
+
+# Everything a retention run would delete, computed before anything is touched
+class RetentionPlan:
+    def __init__(self):
+        self.files = FileCatalog()          # Expired files
+        self.by_category = {}               # category -> [file count, bytes]
+        self.snapshots = []                 # Snapshot days to remove
+        self.snapshot_rules = {}
+
+    @property
+    def bytes(self):
+        return sum(self.files.sizes)
+
+    def summary(self):
+        lines = [f"{category}: {count:,} files, {size / 1e6:.1f} MB expired"
+                 for category, (count, size) in sorted(self.by_category.items())]
+        if self.snapshots:
+            lines.append(f"Backup snapshots: {', '.join(self.snapshots)}")
+        return lines
+
+# One streaming pass over the tree (and the snapshot list) that builds the deletion plan
+def plan_retention(base_path, spec, now=None):
+    now = now or time.time()
+    plan = RetentionPlan()
+    policies = {category: RetentionPolicy(policy) for category, policy in spec.get('categories', {}).items()}
+    fallback = policies.pop('*', None)
+
+    if policies or fallback:
+        classifier = get_classifier()
+        for _, source_path, st in iter_backup_sources(base_path):
+            category = classifier.classify(source_path, st) or 'Uncategorized'
+            policy = policies.get(category, fallback)
+            if policy is not None and policy.expired(st.st_mtime, now):
+                folder, name = os.path.split(source_path)
+                plan.files.add(plan.files.dir_id(folder), name, st.st_size, st.st_mtime)
+                totals = plan.by_category.setdefault(category, [0, 0])
+                totals[0] += 1
+                totals[1] += st.st_size
+
+    rules = spec.get('snapshots', {})
+    plan.snapshot_rules = {key: rules[key] for key in ('keep_days', 'daily', 'weekly', 'monthly') if key in rules}
+    if plan.snapshot_rules:
+        days = list_snapshots(base_path)
+        keep = snapshots_to_keep(days, **plan.snapshot_rules)
+        plan.snapshots = [day for day in days if day not in keep]
+    return plan
+
+# Delete a plan's files in parallel batches, then prune its snapshots
+@instrumented('execute_retention')
+def execute_retention(base_path, plan, workers=None):
+    def delete_batch(batch):
+        deleted = failed = 0
+        for file_path in batch:
+            try:
+                os.remove(file_path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                failed += 1
+                logger.warning(Fore.YELLOW + f'Failed to delete {file_path}: {e}')
+        return deleted, failed
+
+    paths = iter(plan.files)
+    batches = iter(lambda: list(itertools.islice(paths, RETENTION_DELETE_BATCH)), [])
+    deleted = failed = 0
+    for batch_deleted, batch_failed in bounded_map(delete_batch, batches, workers or TRANSFER_WORKERS, 'smartfm-retain'):
+        deleted += batch_deleted
+        failed += batch_failed
+
+    result = {'deleted': deleted, 'failed': failed, 'bytes': plan.bytes}
+    if plan.snapshot_rules:
+        result.update(prune_snapshots(base_path, workers=workers, **plan.snapshot_rules))
+    logger.info(Fore.GREEN + f'Retention run: {result}')
+    return result
+
+# Plan, show the dry-run summary through preview_files, then delete on confirmation
+def apply_retention(base_path, spec=None, confirm=True):
+    spec = load_retention() if spec is None else spec
+    if not spec:
+        print(f"No retention policy found. Create {RETENTION_FILE} to define one.")
+        return None
+    plan = plan_retention(base_path, spec)
+    summary = plan.summary()
+    if not summary:
+        print("Nothing to clean up.")
+        return None
+    if confirm and not preview_files(summary):
+        print("No changes made.")
+        return None
+    result = execute_retention(base_path, plan)
+    print(f"Deleted {result['deleted']:,} files ({plan.bytes / 1e6:.1f} MB), "
+          f"removed {len(result.get('snapshots', []))} snapshots.")
+    return result
+
+# ------------------ Batch CLI ------------------
+
+# Subcommands understood by `smartfm <command> ...`; anything else starts the menu
+CLI_COMMANDS = ('sort', 'backup', 'list', 'clean', 'hash', 'dedupe', 'prune', 'recover', 'daemon', 'call', 'batch')
+
+# Writes one JSON object per line, so any amount of output streams in constant memory
+class JsonLinesWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.records = 0
+
+    def emit(self, record):
+        self.stream.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+        self.records += 1
+
+def cli_sort(args):
+    files = analysis_file_from_folder(args.path)
+    engine = TransferEngine()
+    plan = plan_sort(args.path, detect_files(files))
+    for source, target, category, error in run_sort_plan(plan, engine):
+        record = {'op': 'sort', 'source': source, 'target': target, 'category': category}
+        if error is not None:
+            record['error'] = str(error)
+        yield record
+    yield dict({'op': 'sort', 'summary': True}, **engine.throughput())
+
+def cli_recover(args):
+    action = 'rollback' if args.rollback else 'discard' if args.discard else 'resume'
+    counts = recover_moves(args.path, action)
+    if counts is None:
+        yield {'op': 'recover', 'path': args.path, 'journal': False}
+        return
+    record = dict({'op': 'recover', 'path': args.path, 'journal': True}, **counts)
+    if counts['failed']:
+        record['error'] = f"{counts['failed']} moves could not be recovered; the journal was kept (use --discard to drop it)"
+    yield record
+
+def cli_backup(args):
+    counts = backup_files(args.path)
+    yield dict({'op': 'backup', 'path': args.path}, **counts)
+
+def cli_list(args):
+    start = os.path.join(args.path, args.folder) if args.folder else args.path
+    classifier = get_classifier()
+    max_depth = None if args.recursive else 0
+    for entry, _ in scan_tree(start, max_depth=max_depth, exclude=backup_exclude(args.path, start)):
+        st = entry.stat()
+        category = classifier.classify(entry.path, st)
+        if args.category and (category or '').lower() != args.category.lower():
+            continue
+        yield {'op': 'list', 'path': entry.path, 'size': st.st_size,
+               'mtime': st.st_mtime, 'category': category}
+
+def cli_clean(args):
+    cutoff_start, cutoff_end = parse_day(args.start), parse_day(args.end)
+    full_path = os.path.join(args.path, args.folder)
+    for file_path, _, mod_time, error in clean_files_between(full_path, cutoff_start, cutoff_end,
+                                                             args.dry_run, args.recursive, args.path):
+        record = {'op': 'clean', 'path': file_path, 'mtime': mod_time, 'deleted': error is None and not args.dry_run}
+        if error is not None:
+            record['error'] = str(error)
+        yield record
+
+def cli_hash(args):
+    algorithm = args.algorithm or HASH_ALGORITHM
+    if args.files:
+        files = [os.path.join(args.path, f) for f in args.files]
+    else:
+        max_depth = None if args.recursive else 0
+        files = (entry.path for entry, _ in scan_tree(args.path, max_depth=max_depth))
+    cache = get_hash_cache(args.path, managed=False)
+    for file_path, digest in iter_file_hashes(files, algorithm, cache):
+        record = {'op': 'hash', 'path': file_path, 'algorithm': algorithm, 'hash': digest}
+        if digest is None:
+            record['error'] = 'unreadable'
+        yield record
+    cache.save()
+
+def cli_dedupe(args):
+    groups = []
+    for digest, size, group in find_duplicates(args.path, min_size=args.min_size):
+        groups.append((digest, group))
+        yield {'op': 'dedupe', 'hash': digest, 'size': size, 'paths': group}
+    if args.action != 'report' and groups:
+        cache = get_hash_cache(args.path, managed=False)
+        resolved = resolve_duplicates(groups, args.action, confirm=not args.yes, cache=cache)
+        cache.save()
+        yield {'op': 'dedupe', 'summary': True, 'action': args.action, 'resolved': resolved}
+
+def cli_prune(args):
+    rules = {key: getattr(args, key) for key in ('keep_days', 'daily', 'weekly', 'monthly')
+             if getattr(args, key) is not None}
+    if not args.policy:
+        yield dict({'op': 'prune', 'dry_run': args.dry_run}, **prune_snapshots(args.path, dry_run=args.dry_run, **rules))
+        return
+
+    # Full retention policy: expired files per category plus snapshot rotation
+    spec = load_retention(args.policy if isinstance(args.policy, str) else None)
+    if rules:
+        spec['snapshots'] = rules
+    plan = plan_retention(args.path, spec)
+    for category, (count, size) in sorted(plan.by_category.items()):
+        yield {'op': 'prune', 'category': category, 'files': count, 'bytes': size, 'dry_run': args.dry_run}
+    if args.dry_run:
+        yield {'op': 'prune', 'dry_run': True, 'snapshots': plan.snapshots}
+    else:
+        yield dict({'op': 'prune', 'dry_run': False}, **execute_retention(args.path, plan))
+
+# Run every command line of a file (or stdin) in this one process, sharing caches
+def cli_batch(args, parser):
+    source = sys.stdin if args.source == '-' else open(args.source, 'r', encoding='utf-8')
+    try:
+        for line_number, line in enumerate(source, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                op_args = parser.parse_args(shlex.split(line))
+            except SystemExit:
+                yield {'op': 'batch', 'line': line_number, 'error': f'invalid command: {line}'}
+                continue
+            if op_args.command == 'batch':
+                yield {'op': 'batch', 'line': line_number, 'error': 'batch cannot be nested'}
+                continue
+            for record in run_cli_command(op_args, parser):
+                yield dict(record, line=line_number)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+def cli_daemon(args):
+    daemon = SmartFMDaemon(args.paths, args.socket, initial_backup=not args.no_initial_backup)
+    yield dict({'op': 'daemon', 'stopped': True}, **daemon.run())
+
+# Parse key=value parameters; values are JSON when they parse as JSON (numbers, true, lists)
+def parse_call_params(pairs):
+    params = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise ValueError(f'expected key=value, got {pair!r}')
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+def cli_call(args):
+    pairs, path = list(args.params), args.path
+    # argparse cannot tell an omitted path from a first key=value parameter
+    if path is not None and '=' in path and not os.path.exists(path):
+        pairs.insert(0, path)
+        path = None
+    params = parse_call_params(pairs)
+    if path:
+        params['path'] = path
+    result = daemon_request(args.op, args.socket, **params)
+    if isinstance(result, list):
+        for item in result:
+            yield dict({'op': args.op}, **item)
+    elif isinstance(result, dict):
+        yield dict({'op': args.op}, **result)
+    else:
+        yield {'op': args.op, 'result': result}
+
+CLI_HANDLERS = {
+    'sort': cli_sort,
+    'backup': cli_backup,
+    'list': cli_list,
+    'clean': cli_clean,
+    'hash': cli_hash,
+    'dedupe': cli_dedupe,
+    'prune': cli_prune,
+    'recover': cli_recover,
+    'daemon': cli_daemon,
+    'call': cli_call,
+}
+
+# Run one parsed command, turning failures into an error record instead of aborting
+def run_cli_command(args, parser):
+    try:
+        if args.command == 'batch':
+            yield from cli_batch(args, parser)
+        else:
+            yield from CLI_HANDLERS[args.command](args)
+    except Exception as e:
+        logger.exception(Fore.RED + f'{args.command} failed')
+        yield {'op': args.command, 'error': str(e)}
+
+def build_cli_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='smartfm', description='Smart File Manager batch commands (NDJSON output)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('sort', help='sort the files of a folder into category folders')
+    p.add_argument('path')
+
+    p = commands.add_parser('backup', help='back up changed files')
+    p.add_argument('path')
+
+    p = commands.add_parser('list', help='list files with size, mtime and category')
+    p.add_argument('path')
+    p.add_argument('--folder', help='only list this folder under path')
+    p.add_argument('--recursive', action='store_true')
+    p.add_argument('--category')
+
+    p = commands.add_parser('clean', help='delete files of a folder modified between two dates')
+    p.add_argument('path')
+    p.add_argument('--folder', required=True)
+    p.add_argument('--start', required=True, help='YYYY-MM-DD')
+    p.add_argument('--end', required=True, help='YYYY-MM-DD')
+    p.add_argument('--recursive', action='store_true')
+    p.add_argument('--dry-run', action='store_true')
+
+    p = commands.add_parser('hash', help='hash files in parallel')
+    p.add_argument('path')
+    p.add_argument('files', nargs='*', help='files relative to path (default: every file in path)')
+    p.add_argument('--algorithm', choices=hash_algorithms())
+    p.add_argument('--recursive', action='store_true')
+
+    p = commands.add_parser('dedupe', help='find duplicate files')
+    p.add_argument('path')
+    p.add_argument('--action', choices=('report', 'hardlink', 'delete'), default='report')
+    p.add_argument('--min-size', type=int, default=1)
+    p.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+
+    p = commands.add_parser('prune', help='apply retention: old files per category, snapshot rotation, unreferenced blobs')
+    p.add_argument('path')
+    p.add_argument('--keep-days', type=int, help='keep snapshots newer than N days')
+    p.add_argument('--daily', type=int, help='keep the newest N daily snapshots')
+    p.add_argument('--weekly', type=int, help='keep one snapshot for each of the last N weeks')
+    p.add_argument('--monthly', type=int, help='keep one snapshot for each of the last N months')
+    p.add_argument('--policy', nargs='?', const=True,
+                   help='also delete expired files using the retention file (optionally give its path)')
+    p.add_argument('--dry-run', action='store_true')
+
+    p = commands.add_parser('recover', help='finish or undo a sort interrupted by a crash, from its move journal')
+    p.add_argument('path')
+    group = p.add_mutually_exclusive_group()
+    group.add_argument('--rollback', action='store_true', help='move files back instead of finishing the run')
+    group.add_argument('--discard', action='store_true', help='delete the journal and leave every file where it is')
+
+    p = commands.add_parser('daemon', help='serve one or more folders over a local socket (JSON lines)')
+    p.add_argument('paths', nargs='+')
+    p.add_argument('--socket', help=f'socket path (default: SMARTFM_SOCKET or {DAEMON_SOCKET})')
+    p.add_argument('--no-initial-backup', action='store_true')
+
+    p = commands.add_parser('call', help='send one request to a running daemon')
+    p.add_argument('op', choices=SmartFMDaemon.READ_OPS + SmartFMDaemon.WRITE_OPS + ('shutdown',))
+    p.add_argument('path', nargs='?')
+    p.add_argument('params', nargs='*', help='request parameters as key=value (e.g. folder=Logs recursive=true)')
+    p.add_argument('--socket')
+
+    p = commands.add_parser('batch', help='run many commands, one per line, from a file or stdin')
+    p.add_argument('source', nargs='?', default='-')
+
+    for p in commands.choices.values():
+        p.add_argument('--metrics-file', help='write metrics on exit (.prom for Prometheus text, else JSON)')
+        p.add_argument('--profile', action='append', default=[], metavar='OPERATION',
+                       help='run an operation (e.g. backup_files) under cProfile; repeatable')
+    return parser
+
+# Entry point for `smartfm <command>`: JSON records go to stdout, human messages to stderr
+def run_cli(argv):
+    import contextlib
+
+    parser = build_cli_parser()
+    args = parser.parse_args(argv)
+    configure()
+    global METRICS_FILE
+    if args.metrics_file:
+        if not METRICS_FILE:
+            atexit.register(export_metrics_at_exit)
+        METRICS_FILE = args.metrics_file
+    PROFILE_OPERATIONS.update(args.profile)
+    console.setLevel(logging.WARNING)
+    writer = JsonLinesWriter(sys.stdout)
+    failed = False
+    with contextlib.redirect_stdout(sys.stderr):
+        for record in run_cli_command(args, parser):
+            failed = failed or 'error' in record
+            writer.emit(record)
+    sys.stdout.flush()
+    return 1 if failed else 0
+
+# ------------------ Startup ------------------
+
+# Seconds from import to an interactive menu before a warning is logged
+STARTUP_BUDGET_SECONDS = 0.5
+
+# Load .env and apply SMARTFM_* overrides to the tunables above
+def configure():
+    global BACKUP_DEBOUNCE_SECONDS, BACKUP_QUEUE_SIZE, BACKUP_BATCH_SIZE, TRANSFER_WORKERS
+    global HASH_ALGORITHM, HASH_WORKERS, RULES_FILE, RETENTION_FILE, STARTUP_BUDGET_SECONDS
+    global METRICS_FILE, PROFILE_DIR, DELTA_MIN_SIZE, DELTA_CHUNK_SIZE, DAEMON_SOCKET
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    BACKUP_DEBOUNCE_SECONDS = float(os.getenv('SMARTFM_DEBOUNCE', BACKUP_DEBOUNCE_SECONDS))
+    BACKUP_QUEUE_SIZE = int(os.getenv('SMARTFM_QUEUE_SIZE', BACKUP_QUEUE_SIZE))
+    BACKUP_BATCH_SIZE = int(os.getenv('SMARTFM_BATCH_SIZE', BACKUP_BATCH_SIZE))
+    TRANSFER_WORKERS = int(os.getenv('SMARTFM_COPY_WORKERS', TRANSFER_WORKERS))
+    HASH_ALGORITHM = os.getenv('SMARTFM_HASH', HASH_ALGORITHM)
+    HASH_WORKERS = int(os.getenv('SMARTFM_HASH_WORKERS', HASH_WORKERS))
+    RULES_FILE = os.getenv('SMARTFM_RULES', RULES_FILE)
+    RETENTION_FILE = os.getenv('SMARTFM_RETENTION', RETENTION_FILE)
+    DELTA_MIN_SIZE = int(os.getenv('SMARTFM_DELTA_MIN_SIZE', DELTA_MIN_SIZE))
+    DELTA_CHUNK_SIZE = int(os.getenv('SMARTFM_DELTA_CHUNK_SIZE', DELTA_CHUNK_SIZE))
+    DAEMON_SOCKET = os.getenv('SMARTFM_SOCKET', DAEMON_SOCKET)
+    STARTUP_BUDGET_SECONDS = float(os.getenv('SMARTFM_STARTUP_BUDGET', STARTUP_BUDGET_SECONDS))
+    METRICS_FILE = os.getenv('SMARTFM_METRICS_FILE', METRICS_FILE)
+    PROFILE_DIR = os.getenv('SMARTFM_PROFILE_DIR', PROFILE_DIR)
+    PROFILE_OPERATIONS.update(name.strip() for name in os.getenv('SMARTFM_PROFILE', '').split(',') if name.strip())
+    level = os.getenv('SMARTFM_LOG_LEVEL')
+    if level:
+        logger.setLevel(level.upper())
+        console.setLevel(level.upper())
+        fileHandler.setLevel(level.upper())
+    if METRICS_FILE:
+        atexit.register(export_metrics_at_exit)
+
+# Final metrics dump when SMARTFM_METRICS_FILE or --metrics-file is set
+def export_metrics_at_exit():
+    if METRICS_FILE:
+        try:
+            metrics.export(METRICS_FILE)
+        except OSError as e:
+            logger.error(Fore.RED + f'Could not write metrics to {METRICS_FILE}: {e}')
+
+# Progress of the background startup (initial backup, index build, watcher) for the menu
+class StartupStatus:
+    def __init__(self):
+        self.phase = 'starting'             # starting, backup, indexing, ready or failed
+        self.files_seen = 0
+        self.error = None
+        self.index = None
+        self.handler = None                 # RealTimeBackupHandler of the watched path
+        self.started = time.perf_counter()
+        self.finished = None
+        self.done = threading.Event()
+
+    @property
+    def ready(self):
+        return self.phase == 'ready'
+
+    def describe(self):
+        if self.phase == 'backup':
+            return f'Initial backup running: {self.files_seen:,} files checked'
+        if self.phase == 'indexing':
+            return 'Building file index...'
+        if self.phase == 'failed':
+            return f'Startup failed: {self.error}'
+        if self.phase == 'ready':
+            return f'Ready (background startup took {self.finished - self.started:.1f}s)'
+        return 'Starting...'
+
+# Start the watcher, run the initial backup and build the index on a background thread
+def start_background_startup(path, initial_backup=True, observer=None):
+    status = StartupStatus()
+
+    def progress(files_seen):
+        status.files_seen = files_seen
+
+    def run():
+        try:
+            index = FileIndex(path)
+            _, status.handler = start_realtime_backup(path, index, observer)
+            if initial_backup:
+                status.phase = 'backup'
+                backup_files(path, progress=progress)
+            status.phase = 'indexing'
+            index.rebuild()
+            status.index = index
+            status.phase = 'ready'
+        except Exception as e:
+            status.error = e
+            status.phase = 'failed'
+            logger.exception(Fore.RED + 'Background startup failed')
+        finally:
+            status.finished = time.perf_counter()
+            status.done.set()
+
+    threading.Thread(target=run, name='smartfm-startup', daemon=True).start()
+    return status
+
+# Log how long import and startup took, warning when over budget
+def report_startup_time(started):
+    import_seconds = started - _import_started
+    startup_seconds = time.perf_counter() - _import_started
+    logger.debug(f'Import took {import_seconds * 1000:.1f} ms, menu ready after {startup_seconds * 1000:.1f} ms')
+    if startup_seconds > STARTUP_BUDGET_SECONDS:
+        logger.warning(Fore.YELLOW + f'Startup took {startup_seconds:.2f}s, over the '
+                                     f'{STARTUP_BUDGET_SECONDS:.2f}s budget')
+    return startup_seconds
+
+# ------------------ Daemon ------------------
+
+# One long-running process owns the watcher, backups and index of its base paths and
+# answers JSON-lines requests on a Unix socket: {"id": 1, "op": "list", "path": "..."}
+# -> {"id": 1, "ok": true, "result": ...}. Reads run on a small query pool, writes
+# (sort, clean, backup) on the transfer pool, one at a time per base path.
+DAEMON_SOCKET = os.path.join(os.path.expanduser('~'), '.smartfm.sock')
+DAEMON_SOCKET_MODE = 0o660                  # Owner and group may connect
+DAEMON_QUERY_WORKERS = 4
+DAEMON_MAX_REQUEST = 1024 * 1024            # Longest accepted request line
+
+class DaemonError(Exception):
+    pass
+
+# Join a client-supplied relative path onto a served tree. Absolute paths, ../ and
+# symlinks that resolve outside the tree are refused.
+def resolve_within(base_path, relative_path):
+    path = os.path.normpath(os.path.join(base_path, relative_path))
+    base = os.path.realpath(base_path)
+    resolved = os.path.realpath(path)
+    if resolved != base and not resolved.startswith(base + os.sep):
+        raise DaemonError(f'{relative_path!r} is outside {base_path}')
+    return path
+
+class SmartFMDaemon:
+    def __init__(self, paths, socket_path=None, initial_backup=True):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.socket_path = socket_path or DAEMON_SOCKET
+        self.initial_backup = initial_backup
+        self.trees = {}                     # Base path -> StartupStatus (index, watcher handler)
+        self.observer = None
+        self.query_pool = ThreadPoolExecutor(DAEMON_QUERY_WORKERS, thread_name_prefix='smartfm-query')
+        self.work_pool = ThreadPoolExecutor(TRANSFER_WORKERS, thread_name_prefix='smartfm-daemon')
+        self.write_locks = {}
+        self.stopping = None
+        self.clients = {}                   # Connection task -> its stream writer
+        self.requests = 0
+
+    def start_trees(self):
+        from watchdog.observers import Observer
+
+        self.observer = Observer()
+        self.observer.start()
+        for path in self.paths:
+            folder_check(path)
+            self.trees[path] = start_background_startup(path, self.initial_backup, self.observer)
+
+    def stop_trees(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        for path, status in self.trees.items():
+            status.done.wait(timeout=5)
+            if status.handler is not None:
+                status.handler.stop()
+            if status.index is not None:
+                status.index.close()
+            get_hash_cache(path).save()
+        self.query_pool.shutdown(wait=True)
+        self.work_pool.shutdown(wait=True)
+
+    # The StartupStatus of a request's path; only paths given at startup are served
+    def tree(self, request, need_index=True):
+        path = request.get('path')
+        if path is None and len(self.paths) == 1:
+            path = self.paths[0]
+        if path is None:
+            raise DaemonError('path is required when several paths are served')
+        path = os.path.abspath(os.path.expanduser(path))
+        status = self.trees.get(path)
+        if status is None:
+            raise DaemonError(f'{path} is not served by this daemon')
+        if need_index and status.index is None:
+            raise DaemonError(f'{path} is not ready yet: {status.describe()}')
+        return path, status
+
+    # ---- operations (run on the pools) ----
+
+    def op_status(self, request):
+        trees = []
+        for path, status in self.trees.items():
+            tree = {'path': path, 'phase': status.phase, 'status': status.describe()}
+            if status.index is not None:
+                rows = status.index.stats()
+                tree['files'] = sum(row['files'] for row in rows)
+                tree['bytes'] = sum(row['bytes'] or 0 for row in rows)
+            if status.handler is not None:
+                tree['pending_events'] = status.handler.events.qsize()
+            trees.append(tree)
+        return {'pid': os.getpid(), 'requests': self.requests, 'trees': trees}
+
+    def op_list(self, request):
+        _, status = self.tree(request)
+        rows = status.index.listing(request.get('folder') or '', request.get('recursive', False),
+                                    request.get('category'), request.get('limit'))
+        return [dict(row) for row in rows]
+
+    def op_search(self, request):
+        _, status = self.tree(request)
+        criteria = {key: request[key] for key in ('category', 'name', 'min_size', 'modified_after',
+                                                  'modified_before', 'order', 'limit') if key in request}
+        return [dict(row) for row in status.index.search(**criteria)]
+
+    def op_stats(self, request):
+        _, status = self.tree(request)
+        return [dict(row) for row in status.index.stats()]
+
+    def op_hash(self, request):
+        path, status = self.tree(request)
+        algorithm = request.get('algorithm') or HASH_ALGORITHM
+        if algorithm not in hash_algorithms():
+            raise DaemonError(f'unknown algorithm {algorithm}')
+        files = request.get('files')
+        if not files:
+            rows = status.index.listing(request.get('folder') or '', request.get('recursive', False))
+            files = [row['path'] for row in rows]
+        cache = get_hash_cache(path)
+        files = [resolve_within(path, f) for f in files]
+        result = [{'path': file_path, 'hash': digest}
+                  for file_path, digest in iter_file_hashes(files, algorithm, cache)]
+        cache.save()
+        return result
+
+    def op_sort(self, request):
+        path, status = self.tree(request)
+        folder = resolve_within(path, request['folder']) if request.get('folder') else path
+        plan = plan_sort(path, detect_files(analysis_file_from_folder(folder)))
+        engine = TransferEngine()
+        moved, failed, touched = 0, [], []
+        for source, target, _, error in run_sort_plan(plan, engine):
+            if error is None:
+                moved += 1
+                touched += [source, target]
+            else:
+                failed.append({'path': source, 'error': str(error)})
+        # Answer the next listing from fresh rows without waiting for the watcher
+        status.index.apply_paths(touched)
+        return dict(engine.throughput(), moved=moved, failed=failed)
+
+    def op_clean(self, request):
+        path, status = self.tree(request)
+        cutoff_start, cutoff_end = parse_day(request['start']), parse_day(request['end'])
+        records = []
+        for file_path, _, mod_time, error in clean_indexed(status.index, request.get('folder') or '', cutoff_start,
+                                                            cutoff_end, request.get('dry_run', False),
+                                                            request.get('recursive', False)):
+            record = {'path': file_path, 'mtime': mod_time, 'deleted': error is None and not request.get('dry_run')}
+            if error is not None:
+                record['error'] = str(error)
+            records.append(record)
+        return records
+
+    def op_backup(self, request):
+        path, _ = self.tree(request, need_index=False)
+        return backup_files(path)
+
+    def op_metrics(self, request):
+        if request.get('format') == 'prometheus':
+            return metrics.to_prometheus()
+        return metrics.snapshot()
+
+    READ_OPS = ('status', 'list', 'search', 'stats', 'hash', 'metrics')
+    WRITE_OPS = ('sort', 'clean', 'backup')
+
+    # ---- asyncio server ----
+
+    async def dispatch(self, request):
+        import asyncio
+
+        op = request.get('op')
+        if op == 'shutdown':
+            self.stopping.set()
+            return 'stopping'
+        if op not in self.READ_OPS + self.WRITE_OPS:
+            raise DaemonError(f'unknown op {op!r}')
+        loop = asyncio.get_running_loop()
+        func = functools.partial(getattr(self, 'op_' + op), request)
+        if op in self.READ_OPS:
+            return await loop.run_in_executor(self.query_pool, func)
+        path, _ = self.tree(request, need_index=False)
+        lock = self.write_locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            return await loop.run_in_executor(self.work_pool, func)
+
+    async def handle_client(self, reader, writer):
+        import asyncio
+
+        self.clients[asyncio.current_task()] = writer
+        try:
+            while not reader.at_eof():
+                line = await reader.readline()
+                if not line.strip():
+                    continue
+                self.requests += 1
+                request_id = None
+                started = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise DaemonError('request must be a JSON object')
+                    request_id = request.get('id')
+                    response = {'id': request_id, 'ok': True, 'result': await self.dispatch(request)}
+                except Exception as e:
+                    if not isinstance(e, (DaemonError, ValueError, KeyError)):
+                        logger.exception(Fore.RED + 'Daemon request failed')
+                    response = {'id': request_id, 'ok': False, 'error': str(e)}
+                metrics.observe('smartfm_daemon_request_seconds', time.perf_counter() - started)
+                writer.write(json.dumps(response, separators=(',', ':'), default=str).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            # ValueError: request line over DAEMON_MAX_REQUEST
+            logger.warning(Fore.YELLOW + f'Daemon client dropped: {e}')
+        finally:
+            self.clients.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def serve(self):
+        import asyncio
+        import signal
+
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path, limit=DAEMON_MAX_REQUEST)
+        os.chmod(self.socket_path, DAEMON_SOCKET_MODE)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        logger.warning(Fore.GREEN + f'Daemon serving {", ".join(self.paths)} on {self.socket_path}')
+        try:
+            async with server:
+                await self.stopping.wait()
+                # Closing the transports ends each client loop at its next read
+                for writer in list(self.clients.values()):
+                    writer.close()
+                await asyncio.gather(*self.clients, return_exceptions=True)
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def run(self):
+        import asyncio
+
+        claim_socket(self.socket_path)
+        self.start_trees()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.stop_trees()
+        return {'requests': self.requests}
+
+# Remove a socket left by a crashed daemon; refuse when a live daemon still answers on it
+def claim_socket(socket_path):
+    import socket
+
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise DaemonError(f'A daemon is already listening on {socket_path}')
+
+# Send one request to a running daemon and return its result
+def daemon_request(op, socket_path=None, **params):
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or DAEMON_SOCKET)
+        sock.sendall(json.dumps(dict(params, op=op, id=1)).encode() + b'\n')
+        with sock.makefile('r', encoding='utf-8') as f:
+            response = json.loads(f.readline())
+    if not response.get('ok'):
+        raise DaemonError(response.get('error'))
+    return response['result']
+
 # ------------------ Main Program Loop ------------------
 def main():
-    path = sys.argv[1] if len(sys.argv) > 1 else './Desktop'  # Use given path or default to Desktop
+    started = time.perf_counter()
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        return run_cli(sys.argv[1:])
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='smartfm', description='Smart File Manager')
+    parser.add_argument('path', nargs='?', default='./Desktop', help='folder to manage (default: ./Desktop)')
+    parser.add_argument('--no-initial-backup', action='store_true',
+                        help='skip the full backup at startup (the watcher still backs up changes)')
+    args = parser.parse_args()
+
+    configure()
+    from colorama import init
+    init(autoreset=True)
+
+    path = args.path
     folder_check(path)
-    backup_files(path)
-    start_realtime_backup(path)
+    if os.path.exists(move_journal_path(path)):
+        answer = input('A previous sort was interrupted. (r)esume it, roll it (b)ack, (d)iscard the journal, '
+                       'or (i)gnore? ').strip().lower()
+        if answer in ('r', 'b'):
+            counts = recover_moves(path, 'rollback' if answer == 'b' else 'resume')
+            print(f"Recovered: {counts['moved']} moved, {counts['restored']} moved back, {counts['failed']} failed.")
+        elif answer == 'd':
+            recover_moves(path, 'discard')
+            print("Journal discarded; files were left where they are.")
+    status = start_background_startup(path, initial_backup=not args.no_initial_backup)
+    report_startup_time(started)
 
     while True:
+        # Until the background startup finishes, listings fall back to scanning the disk
+        index = status.index
         print('\n===== Smart File Manager =====')
+        if not status.ready:
+            print(f'[{status.describe()}]')
         print('1. Store File')
         print('2. List All Files with Directory')
         print('3. List Directories')
@@ -344,9 +3662,16 @@ def main():
         print('7. Delete Empty Folders')
         print('8. Preview Files in Folder')
         print('9. Generate Hash of File')
-        print('10. Exit')
+        print('10. Restore Backup Snapshot')
+        print('11. Find Duplicate Files')
+        print('12. Search Files')
+        print('13. File Statistics')
+        print('14. Startup Status')
+        print('15. Apply Retention Policy')
+        print('16. Export Metrics')
+        print('17. Exit')
 
-        choice = input("Choose an option (1-10): ").strip()
+        choice = input("Choose an option (1-17): ").strip()
 
         if choice == '1':
             file_name = input('Enter file name: ')
@@ -358,20 +3683,21 @@ def main():
                 print('Files successfully sorted.')
 
         elif choice == '2':
-            get_file(path)
+            get_file(path, index)
 
         elif choice == '3':
             get_folder(path)
 
         elif choice == '4':
             directory = input('Enter directory name: ')
-            get_file_exact_folder(path, directory)
+            get_file_exact_folder(path, directory, index)
 
         elif choice == '5':
             directory = input('Enter directory name: ')
             time_str_s = input('Enter start date (YYYY-MM-DD): ')
             time_str_e = input('Enter end date (YYYY-MM-DD): ')
-            old_file_clean(path, time_str_s, time_str_e, directory)
+            recursive = input('Include subfolders? (y/n): ').strip().lower() == 'y'
+            old_file_clean(path, time_str_s, time_str_e, directory, index, recursive)
 
 
         elif choice == '6':
@@ -380,18 +3706,14 @@ def main():
 
 
         elif choice == '7':
-            delete_if_empty(path)
-            print(detect_files(path))
+            delete_if_empty(path, index)
+            print(detect_files(analysis_file_from_folder(path)))
 
         elif choice == '8':
             directory = input("Enter directory name: ")
             full_folder_path = os.path.join(path, directory)
             if os.path.exists(full_folder_path) and os.path.isdir(full_folder_path):
-                files = [
-                    os.path.join(full_folder_path, f)
-                    for f in os.listdir(full_folder_path)
-                    if os.path.isfile(os.path.join(full_folder_path, f))
-                ]
+                files = analysis_file_from_folder(full_folder_path)
                 if files:
                     preview_files(files)
                 else:
@@ -402,36 +3724,95 @@ def main():
 
 
         elif choice == '9':
-
             folder = input("Enter folder name: ").strip()
-
-            file_name = input("Enter file name: ").strip()
+            file_name = input("Enter file name (leave empty to hash the whole folder): ").strip()
+            algorithm = input(f"Hash algorithm [{HASH_ALGORITHM}]: ").strip().lower() or HASH_ALGORITHM
+            if algorithm not in hash_algorithms():
+                print(f"Unknown algorithm '{algorithm}'. Choose from: {', '.join(hash_algorithms())}")
+                continue
 
             folder_path = os.path.join(path, folder)
+            cache = get_hash_cache(path, managed=False)
+            if not file_name and os.path.isdir(folder_path):
+                files = analysis_file_from_folder(folder_path)
+                for file_path, file_hash in iter_file_hashes(files, algorithm, cache):
+                    if file_hash:
+                        print(f"{algorithm.upper()} {file_hash}  {os.path.basename(file_path)}")
+                cache.save()
+                continue
 
             file_path = os.path.join(folder_path, file_name)
-
             if os.path.exists(file_path) and os.path.isfile(file_path):
-
-                file_hash = hash_file(file_path)
-
-                print("SHA256 Hash:", file_hash)
-
-                # Log the hash operation
-
-
-
-
+                file_hash = cached_hash(file_path, cache, algorithm)
+                cache.save()
+                print(f"{algorithm.upper()} Hash:", file_hash)
+                logger.info(Fore.CYAN + f'Hashed {file_path} with {algorithm}')
             else:
-
                 print(f"File '{file_name}' not found in folder '{folder}'.")
 
         elif choice == '10':
+            snapshots = list_snapshots(path)
+            if not snapshots:
+                print("No backup snapshots found.")
+                continue
+            print('Available snapshots: ' + ', '.join(snapshots))
+            day = input('Enter snapshot date (YYYY-MM-DD): ').strip()
+            destination = input('Enter destination folder: ').strip()
+            if day in snapshots and destination:
+                restore_snapshot(path, day, destination)
+            else:
+                print(f"Snapshot '{day}' not found.")
+
+        elif choice == '11':
+            groups = report_duplicates(path)
+            if groups:
+                action = input("Replace duplicates with (h)ardlinks, (d)elete them, or (n)othing? ").strip().lower()
+                cache = get_hash_cache(path, managed=False)
+                if action == 'h':
+                    resolve_duplicates(groups, 'hardlink', cache=cache)
+                elif action == 'd':
+                    resolve_duplicates(groups, 'delete', cache=cache)
+                cache.save()
+
+        elif choice in ('12', '13') and index is None:
+            print(f"The file index is not ready yet. {status.describe()}")
+
+        elif choice == '12':
+            category = input('Category (blank for any): ').strip() or None
+            name = input('Name contains (blank for any): ').strip() or None
+            min_size = input('Minimum size in MB (blank for any): ').strip()
+            days = input('Modified within the last N days (blank for any): ').strip()
+            order = input('Sort by size, mtime or name [size]: ').strip().lower() or 'size'
+            try:
+                search_files(
+                    index, category=category, name=name,
+                    min_size=int(float(min_size) * 1024 * 1024) if min_size else None,
+                    modified_after=time.time() - float(days) * 86400 if days else None,
+                    order=order,
+                )
+            except ValueError:
+                print("Size and days must be numbers.")
+
+        elif choice == '13':
+            index_stats(index)
+
+        elif choice == '14':
+            print(status.describe())
+
+        elif choice == '15':
+            apply_retention(path)
+
+        elif choice == '16':
+            target = input(f"Metrics file (.prom for Prometheus text, .json for a snapshot) [{METRICS_FILE or 'metrics.prom'}]: ").strip()
+            target = metrics.export(target or METRICS_FILE or 'metrics.prom')
+            print(f"Metrics written to {target}")
+
+        elif choice == '17':
             print("Exiting program.")
             break
 
         else:
-            print("Invalid option. Please choose between 1-10.")
+            print("Invalid option. Please choose between 1-17.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as sfm
+
+
+# Write a small file, creating its folders; returns the absolute path
+def write(path, data='x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(data)
+    return str(path)
+
+
+# Set a file's mtime to `days` days ago
+def age(path, days):
+    stamp = sfm.time.time() - days * 86400
+    os.utime(path, (stamp, stamp))
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / 'base')
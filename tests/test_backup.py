@@ -0,0 +1,139 @@
+import os
+
+import main as sfm
+from conftest import write
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_chunked_file_restores_byte_for_byte(base, tmp_path, monkeypatch):
+    monkeypatch.setattr(sfm, 'DELTA_ANY_SIZE', 1000)
+    monkeypatch.setattr(sfm, 'DELTA_CHUNK_SIZE', 256)
+    data = bytes(range(256)) * 10 + b'tail'
+    big = os.path.join(base, 'Videos', 'big.bin')
+    os.makedirs(os.path.dirname(big))
+    with open(big, 'wb') as f:
+        f.write(data)
+
+    assert sfm.backup_files(base)['copied'] == 1
+    digest = sfm.load_manifest(base)[os.path.join('Videos', 'big.bin')]['hash']
+    assert len(sfm.load_recipe(base, digest)['chunks']) == 11
+
+    destination = str(tmp_path / 'restored')
+    assert sfm.restore_snapshot(base, sfm.backup_day(), destination) == 1
+    assert read(os.path.join(destination, 'Videos', 'big.bin')) == data
+
+
+def test_garbage_collection_keeps_only_referenced_blobs(base):
+    notes = write(os.path.join(base, 'Documents', 'notes.txt'), 'first version')
+    sfm.backup_files(base)
+    old = sfm.load_manifest(base)[os.path.join('Documents', 'notes.txt')]['hash']
+    write(notes, 'second, longer version')
+    sfm.backup_files(base)
+    new = sfm.load_manifest(base)[os.path.join('Documents', 'notes.txt')]['hash']
+
+    removed, _ = sfm.collect_garbage(base)
+    assert removed == 1
+    assert not os.path.exists(sfm.object_path(base, old))
+    assert os.path.exists(sfm.object_path(base, new))
+
+
+def test_each_day_folder_holds_the_whole_tree(base, monkeypatch):
+    notes = write(os.path.join(base, 'Documents', 'notes.txt'), 'notes')
+    write(os.path.join(base, 'Images', 'photo.jpg'), 'photo')
+    old = write(os.path.join(base, 'old.txt'), 'old')
+    monkeypatch.setattr(sfm, 'backup_day', lambda: '2026-01-01')
+    sfm.backup_files(base)
+
+    monkeypatch.setattr(sfm, 'backup_day', lambda: '2026-01-02')
+    write(notes, 'edited notes')
+    os.remove(old)
+    sfm.backup_paths(base, [notes, old])
+
+    day = os.path.join(base, 'Backup', '2026-01-02')
+    assert read(os.path.join(day, 'Documents', 'notes.txt')) == b'edited notes'
+    assert read(os.path.join(day, 'Images', 'photo.jpg')) == b'photo'
+    assert not os.path.exists(os.path.join(day, 'old.txt'))
+    assert read(os.path.join(base, 'Backup', '2026-01-01', 'Documents', 'notes.txt')) == b'notes'
+
+
+def test_blobs_are_stored_read_only(base, tmp_path):
+    write(os.path.join(base, 'notes.txt'), 'notes')
+    sfm.backup_files(base)
+    digest = sfm.load_manifest(base)['notes.txt']['hash']
+    assert sfm.stat.S_IMODE(os.stat(sfm.object_path(base, digest)).st_mode) & 0o222 == 0
+
+    destination = str(tmp_path / 'restored')
+    sfm.restore_snapshot(base, sfm.backup_day(), destination)
+    assert os.stat(os.path.join(destination, 'notes.txt')).st_mode & sfm.stat.S_IWUSR
+
+
+def test_watcher_backups_append_to_the_manifest_log(base, monkeypatch):
+    notes = write(os.path.join(base, 'Documents', 'notes.txt'), 'notes')
+    write(os.path.join(base, 'Documents', 'keep.txt'), 'keep')
+    write(os.path.join(base, 'Documents old', 'a.txt'), 'a')
+    write(os.path.join(base, 'Documents.txt'), 'top')
+    sfm.backup_files(base)
+    manifest_json = read(sfm.manifest_path(base))
+
+    write(notes, 'edited notes')
+    sfm.backup_paths(base, [notes])
+    removed = os.path.join(base, 'Documents')
+    sfm.shutil.rmtree(removed)
+    sfm.backup_paths(base, [removed])
+
+    assert read(sfm.manifest_path(base)) == manifest_json
+    assert os.path.exists(sfm.manifest_log_path(base))
+    assert sorted(sfm.load_manifest(base)) == [os.path.join('Documents old', 'a.txt'), 'Documents.txt']
+
+    sfm.checkpoint_backup(base)
+    assert not os.path.exists(sfm.manifest_log_path(base))
+    assert sorted(sfm.load_manifest(base)) == [os.path.join('Documents old', 'a.txt'), 'Documents.txt']
+
+
+def test_days_only_in_the_log_get_their_final_tree(base, monkeypatch):
+    notes = write(os.path.join(base, 'notes.txt'), 'monday')
+    monkeypatch.setattr(sfm, 'backup_day', lambda: '2026-01-05')
+    sfm.backup_files(base)
+    write(notes, 'monday evening')
+    sfm.backup_paths(base, [notes])
+    evening = sfm.load_manifest(base)['notes.txt']['hash']
+
+    # A new process on the next day: the log is all that records Monday evening
+    sfm._manifests.clear()
+    monkeypatch.setattr(sfm, 'backup_day', lambda: '2026-01-06')
+    sfm.backup_files(base)
+
+    with open(os.path.join(base, 'Backup', sfm.TREES_DIR, '2026-01-05.json')) as f:
+        assert sfm.json.load(f) == {'notes.txt': evening}
+
+
+def test_later_full_backups_of_a_day_only_touch_what_changed(base, monkeypatch):
+    for i in range(50):
+        write(os.path.join(base, 'Documents', f'note{i}.txt'), f'note {i}')
+    sfm.backup_files(base)
+    os.remove(os.path.join(base, 'Documents', 'note0.txt'))
+
+    calls = []
+    real_stat = os.stat
+    monkeypatch.setattr(sfm.os, 'stat', lambda *a, **k: calls.append(a) or real_stat(*a, **k))
+    sfm.backup_files(base)
+
+    assert len(calls) < 10
+    day = sfm.today_backup_root(base)
+    assert not os.path.exists(os.path.join(day, 'Documents', 'note0.txt'))
+    assert read(os.path.join(day, 'Documents', 'note1.txt')) == b'note 1'
+
+
+def test_a_renamed_folder_is_backed_up_once(base):
+    sfm.backup_files(base)
+    folder = os.path.join(base, 'Renamed')
+    paths = [write(os.path.join(folder, 'sub' if i % 2 else '', f'file{i}.txt'), f'file {i}') for i in range(6)]
+    gone = os.path.join(folder, 'gone.txt')
+
+    counts = sfm.backup_paths(base, [folder, os.path.join(folder, 'sub'), gone] + paths)
+    assert counts['copied'] == 6
+    assert len(sfm.load_manifest(base)) == 6
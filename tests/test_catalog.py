@@ -0,0 +1,34 @@
+import os
+
+import main as sfm
+
+
+def test_catalog_and_views_index_like_the_lists_they_replace(tmp_path):
+    paths = [os.path.join(str(tmp_path), name) for name in ('a.txt', 'b.jpg', 'c.txt', 'd.png', 'e.txt')]
+    catalog = sfm.FileCatalog.from_paths(paths)
+
+    assert list(catalog) == paths
+    assert [catalog[i] for i in range(len(catalog))] == paths
+    assert catalog[-1] == paths[-1]
+    assert list(catalog[1:4]) == paths[1:4]
+    assert list(catalog[::-2]) == paths[::-2]
+
+    documents = catalog.by_category(sfm.Classifier(sniff=False))['Documents']
+    texts = [path for path in paths if path.endswith('.txt')]
+    assert list(documents) == texts
+    assert documents[0] == texts[0] and documents[-1] == texts[-1]
+    assert list(documents[1:]) == texts[1:]
+    assert list(documents[1:][::-1]) == texts[1:][::-1]
+
+
+def test_record_gives_the_other_columns(tmp_path):
+    path = os.path.join(str(tmp_path), 'notes.txt')
+    with open(path, 'w') as f:
+        f.write('12345')
+    catalog = sfm.FileCatalog.scan(str(tmp_path))
+    catalog.classify(sfm.Classifier(sniff=False))
+
+    record = catalog.record(-1)
+    assert (record.path, record.name, record.size, record.extension, record.category) == \
+        (path, 'notes.txt', 5, '.txt', 'Documents')
+    assert catalog.by_category(sfm.Classifier(sniff=False))['Documents'].record(0).size == 5
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+import main as sfm
+from conftest import write
+
+
+@pytest.fixture
+def daemon(base, tmp_path):
+    write(os.path.join(base, 'inside.txt'), 'inside')
+    server = sfm.SmartFMDaemon([base], socket_path=str(tmp_path / 'smartfm.sock'), initial_backup=False)
+    server.start_trees()
+    server.trees[os.path.abspath(base)].done.wait(timeout=10)
+    yield server
+    server.stop_trees()
+
+
+def test_hash_and_sort_refuse_paths_outside_the_tree(daemon, base, tmp_path):
+    outside = write(str(tmp_path / 'outside' / 'secret.txt'), 'secret')
+    os.symlink(os.path.dirname(outside), os.path.join(base, 'link'))
+
+    for files in ([outside], ['../outside/secret.txt'], ['link/secret.txt']):
+        with pytest.raises(sfm.DaemonError):
+            daemon.op_hash({'files': files})
+    for folder in (os.path.dirname(outside), '../outside', 'link'):
+        with pytest.raises(sfm.DaemonError):
+            daemon.op_sort({'folder': folder})
+    assert os.path.exists(outside)
+
+    result = daemon.op_hash({'files': ['inside.txt']})
+    assert result == [{'path': os.path.join(base, 'inside.txt'), 'hash': sfm.hash_file(os.path.join(base, 'inside.txt'))}]
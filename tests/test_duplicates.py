@@ -0,0 +1,39 @@
+import os
+
+import main as sfm
+from conftest import write
+
+
+def duplicate_groups(base):
+    return [(digest, group) for digest, _, group in sfm.find_duplicates(base)]
+
+
+def test_resolve_hardlinks_unchanged_duplicates(base):
+    a = write(os.path.join(base, 'a.txt'), 'same content')
+    b = write(os.path.join(base, 'b.txt'), 'same content')
+    groups = duplicate_groups(base)
+
+    assert sfm.resolve_duplicates(groups, 'hardlink', confirm=False) == 1
+    assert os.stat(a).st_ino == os.stat(b).st_ino
+
+
+def test_resolve_skips_a_file_rewritten_at_the_same_size(base):
+    a = write(os.path.join(base, 'a.txt'), 'same content')
+    b = write(os.path.join(base, 'b.txt'), 'same content')
+    groups = duplicate_groups(base)
+    write(b, 'SAME CONTENT')
+
+    cache = sfm.get_hash_cache(base)
+    assert sfm.resolve_duplicates(groups, 'delete', confirm=False, cache=cache) == 0
+    with open(b) as f:
+        assert f.read() == 'SAME CONTENT'
+    assert os.path.exists(a)
+
+
+def test_hash_and_dedupe_leave_unmanaged_folders_untouched(base):
+    write(os.path.join(base, 'a.txt'), 'same content')
+    write(os.path.join(base, 'b.txt'), 'same content')
+
+    assert sfm.run_cli(['hash', base]) == 0
+    assert sfm.run_cli(['dedupe', base, '--action', 'hardlink', '--yes']) == 0
+    assert sorted(os.listdir(base)) == ['a.txt', 'b.txt']
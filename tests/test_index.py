@@ -0,0 +1,65 @@
+import os
+
+import main as sfm
+from conftest import write, age
+
+
+def listing(capsys, *args):
+    sfm.get_file_exact_folder(*args)
+    return sorted(capsys.readouterr().out.splitlines())
+
+
+def test_indexed_exact_folder_matches_disk_for_backups_category(base, capsys):
+    write(os.path.join(base, 'Backups', 'a.bak'))
+    write(os.path.join(base, 'Backups', 'b.tmp'))
+    os.makedirs(os.path.join(base, 'Empty'))
+    index = sfm.FileIndex(base)
+    index.rebuild()
+    try:
+        for folder in ('Backups', 'Empty', 'Missing'):
+            assert listing(capsys, base, folder, index) == listing(capsys, base, folder)
+        assert listing(capsys, base, 'Backups', index) == ['Found: Filename - a.bak', 'Found: Filename - b.tmp']
+    finally:
+        index.close()
+
+
+def test_indexed_clean_sees_backups_category(base, capsys):
+    old = write(os.path.join(base, 'Backups', 'a.bak'))
+    age(old, 400)
+    keep = write(os.path.join(base, 'Backups', 'b.bak'))
+    index = sfm.FileIndex(base)
+    index.rebuild()
+    try:
+        start = sfm.time.strftime('%Y-%m-%d', sfm.time.localtime(sfm.time.time() - 500 * 86400))
+        end = sfm.time.strftime('%Y-%m-%d', sfm.time.localtime(sfm.time.time() - 300 * 86400))
+        sfm.old_file_clean(base, start, end, 'Backups', index)
+    finally:
+        index.close()
+    assert not os.path.exists(old)
+    assert os.path.exists(keep)
+
+
+def test_indexed_listings_keep_empty_subfolders(base, capsys):
+    write(os.path.join(base, 'Documents', 'a.txt'))
+    os.makedirs(os.path.join(base, 'Documents', 'emptysub'))
+    os.makedirs(os.path.join(base, 'Pictures', '2024'))
+    write(os.path.join(base, 'root.txt'))
+    index = sfm.FileIndex(base)
+    index.rebuild()
+    try:
+        def get_file(*args):
+            sfm.get_file(*args)
+            return sorted(capsys.readouterr().out.splitlines())
+
+        assert get_file(base, index) == get_file(base)
+        assert 'Found: Filename - 2024 in directory - Pictures' in get_file(base, index)
+        for folder in ('Documents', 'Pictures'):
+            assert listing(capsys, base, folder, index) == listing(capsys, base, folder)
+
+        # Folders the watcher reports later are indexed as well
+        os.makedirs(os.path.join(base, 'Music', 'new'))
+        index.apply_paths([os.path.join(base, 'Music')])
+        assert listing(capsys, base, 'Music', index) == ['Found: Filename - new']
+        assert get_file(base, index) == get_file(base)
+    finally:
+        index.close()
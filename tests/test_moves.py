@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+import main as sfm
+from conftest import write
+
+
+# Journal a plan of the given sources into Documents/ without running it, as a crash would leave it
+def journal_plan(base, *sources, cross_device=False):
+    plan = sfm.plan_sort(base, {'Documents': list(sources)})
+    moves = [(source, target, category, size, cross_device) for source, target, category, size, _ in plan.moves]
+    journal = sfm.MoveJournal.create(base, moves)
+    os.makedirs(os.path.join(base, 'Documents'), exist_ok=True)
+    return journal, [target for _, target, _, _, _ in moves]
+
+
+def test_resume_finishes_an_interrupted_sort(base):
+    a = write(os.path.join(base, 'a.txt'))
+    b = write(os.path.join(base, 'b.txt'))
+    journal, (a_target, b_target) = journal_plan(base, a, b)
+    os.rename(a, a_target)                      # Moved, but the crash came before the journal record
+    journal.f.close()
+
+    counts = sfm.recover_moves(base, 'resume')
+    assert counts == {'moved': 2, 'restored': 0, 'failed': 0}
+    assert os.path.exists(a_target) and os.path.exists(b_target)
+    assert not os.path.exists(a) and not os.path.exists(b)
+    assert not os.path.exists(sfm.move_journal_path(base))
+
+
+def test_rollback_moves_files_back(base):
+    a = write(os.path.join(base, 'a.txt'))
+    b = write(os.path.join(base, 'b.txt'))
+    journal, (a_target, b_target) = journal_plan(base, a, b)
+    os.rename(a, a_target)
+    journal.record(0, 1)
+    journal.f.close()
+
+    counts = sfm.recover_moves(base, 'rollback')
+    assert counts == {'moved': 0, 'restored': 1, 'failed': 0}
+    assert os.path.exists(a) and os.path.exists(b)
+    assert not os.path.exists(a_target)
+
+
+def test_resume_redoes_a_cut_short_cross_device_copy(base):
+    a = write(os.path.join(base, 'a.txt'), 'full content')
+    journal, (a_target,) = journal_plan(base, a, cross_device=True)
+    write(a_target, 'full')
+    journal.f.close()
+
+    assert sfm.recover_moves(base, 'resume')['moved'] == 1
+    with open(a_target) as f:
+        assert f.read() == 'full content'
+    assert not os.path.exists(a)
+
+
+def test_failed_move_does_not_block_later_sorts(base):
+    a = write(os.path.join(base, 'a.txt'))
+    journal, (a_target,) = journal_plan(base, a)
+    write(a_target, 'appeared after planning')
+    journal.record(0, 1, failed=[0])
+    journal.f.close()
+
+    assert sfm.recover_moves(base, 'resume') == {'moved': 0, 'restored': 0, 'failed': 0}
+    assert os.path.exists(a)
+    sfm.MoveJournal.create(base, []).finish()
+
+
+def test_discard_drops_an_unrecoverable_journal(base):
+    a = write(os.path.join(base, 'a.txt'))
+    journal, (a_target,) = journal_plan(base, a)
+    write(a_target, 'appeared after planning')
+    journal.f.close()
+
+    assert sfm.recover_moves(base, 'resume')['failed'] == 1
+    with pytest.raises(RuntimeError):
+        sfm.MoveJournal.create(base, [])
+    sfm.recover_moves(base, 'discard')
+    assert not os.path.exists(sfm.move_journal_path(base))
+    assert os.path.exists(a) and os.path.exists(a_target)
+
+
+def test_planning_a_scanned_folder_does_not_stat_each_file(base, monkeypatch):
+    for i in range(20):
+        write(os.path.join(base, f'note{i}.txt'), 'x' * i)
+    categorized = sfm.detect_files(sfm.analysis_file_from_folder(base), sfm.Classifier(sniff=False))
+
+    calls = []
+    real_stat = os.stat
+    monkeypatch.setattr(sfm.os, 'stat', lambda *a, **k: calls.append(a) or real_stat(*a, **k))
+    plan = sfm.plan_sort(base, categorized)
+
+    assert len(plan) == 20
+    assert len(calls) <= 5                       # Per folder, not per file
+    assert sorted(size for _, _, _, size, _ in plan.moves) == list(range(20))
@@ -0,0 +1,35 @@
+import os
+
+import main as sfm
+from conftest import write
+
+
+def test_throughput_counts_the_first_transfer(tmp_path, monkeypatch):
+    source = write(str(tmp_path / 'big.bin'), 'x' * 100000)
+    real_copy = sfm.fast_copy
+
+    def slow_copy(src, dst):
+        sfm.time.sleep(0.1)
+        return real_copy(src, dst)
+
+    monkeypatch.setattr(sfm, 'fast_copy', slow_copy)
+    engine = sfm.TransferEngine()
+    engine.copy(source, str(tmp_path / 'out' / 'big.bin'))
+
+    stats = engine.throughput()
+    assert stats['seconds'] >= 0.1
+    assert stats['bytes_per_second'] <= 100000 / 0.1
+
+
+def test_move_falls_back_to_copy_across_devices(tmp_path, monkeypatch):
+    source = write(str(tmp_path / 'a.txt'), 'data')
+    target = str(tmp_path / 'dst' / 'a.txt')
+
+    def exdev(src, dst):
+        raise OSError(sfm.errno.EXDEV, 'cross-device link')
+
+    monkeypatch.setattr(sfm.os, 'rename', exdev)
+    sfm.TransferEngine().move(source, target)
+    assert not os.path.exists(source)
+    with open(target) as f:
+        assert f.read() == 'data'
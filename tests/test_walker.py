@@ -0,0 +1,56 @@
+import os
+
+import main as sfm
+from conftest import write, age
+
+
+def test_scan_tree_skips_only_the_tool_backup_folder(base):
+    write(os.path.join(base, 'Backup', 'trees', 'x.json'))
+    write(os.path.join(base, 'Backups', 'a.bak'))
+    write(os.path.join(base, 'Projects', 'Backup', 'notes.txt'))
+
+    found = sorted(os.path.relpath(entry.path, base) for entry, _ in sfm.scan_tree(base))
+    assert found == [os.path.join('Backups', 'a.bak'), os.path.join('Projects', 'Backup', 'notes.txt')]
+
+
+def test_is_backup_path_compares_the_first_component(base):
+    assert sfm.is_backup_path(base, os.path.join(base, 'Backup'))
+    assert sfm.is_backup_path(base, os.path.join(base, 'Backup', 'objects', 'ab'))
+    assert not sfm.is_backup_path(base, os.path.join(base, 'Backups', 'a.bak'))
+    assert not sfm.is_backup_path(base, os.path.join(base, 'MyBackup.txt'))
+
+
+def test_retention_plans_files_of_the_sorted_backups_category(base):
+    old = [write(os.path.join(base, 'Backups', name)) for name in ('a.bak', 'b.tmp')]
+    for path in old:
+        age(path, 60)
+    write(os.path.join(base, 'Backups', 'fresh.bak'))
+
+    plan = sfm.plan_retention(base, {'categories': {'Backups': {'max_age_days': 30}}})
+    assert sorted(plan.files) == sorted(old)
+
+
+def test_nested_backup_folder_is_cleaned_and_backed_up_like_any_folder(base):
+    old = write(os.path.join(base, 'Projects', 'Backup', 'old.txt'))
+    old2 = write(os.path.join(base, 'Projects', 'old2.txt'))
+    tool = write(os.path.join(base, 'Backup', 'tool.txt'))
+    for path in (old, old2, tool):
+        age(path, 400)
+    start = sfm.time.time() - 500 * 86400
+    end = sfm.time.time() - 300 * 86400
+
+    def disk(folder):
+        return sorted(p for p, _, _, _ in sfm.clean_files_between(
+            os.path.join(base, folder), start, end, dry_run=True, recursive=True, base_path=base))
+
+    index = sfm.FileIndex(base)
+    index.rebuild()
+    try:
+        for folder in ('Projects', ''):
+            indexed = sorted(p for p, _, _, _ in sfm.clean_indexed(index, folder, start, end, True, True))
+            assert disk(folder) == indexed == [old, old2]
+    finally:
+        index.close()
+
+    subtree = [source for _, source, _ in sfm.iter_backup_sources(base, os.path.join(base, 'Projects'))]
+    assert sorted(subtree) == [old, old2]